@@ -0,0 +1,127 @@
+# pylint: disable=c0111
+
+"""
+Planning a campaign, i.e. a set of runs that cover the cartesian product
+of protocols, interferences, tx powers and channels
+
+The reserved nodes can be split into several disjoint node sets;
+runs that use different node sets and channels that do not overlap
+can then take place at the same time; the campaign is cut into waves,
+where all the runs in a wave are performed simultaneously
+"""
+
+import itertools
+from collections import namedtuple
+
+from channels import channel_frequency
+
+# interference is a string, like in CHOICES_INTERFERENCE
+Config = namedtuple('Config',
+                    ['protocol', 'interference', 'tx_power', 'channel'])
+
+# the nodes that run the routing protocol, and among them
+# the sources and destinations of the pings
+NodeSet = namedtuple('NodeSet', ['node_ids', 'src_ids', 'dest_ids'])
+
+
+# in MHz; 802.11b/g channels are 22MHz wide,
+# the ones in the 5GHz band are 20MHz wide
+def channel_width(channel):
+    return 22 if channel_frequency[int(channel)] < 3000 else 20
+
+
+def channels_overlap(channel1, channel2):
+    """
+    Whether the spectrum used on these 2 channels overlaps
+    """
+    distance = abs(channel_frequency[int(channel1)]
+                   - channel_frequency[int(channel2)])
+    return 2 * distance < channel_width(channel1) + channel_width(channel2)
+
+
+def campaign_configs(*, protocols, interferences, tx_powers, channels):
+    """
+    The cartesian product, as a list of Config
+
+    Configs are sorted so that the ones that differ only by interference
+    come one after the other, starting with no interference
+    """
+    return sorted(
+        (Config(protocol, str(interference), int(tx_power), int(channel))
+         for protocol, interference, tx_power, channel
+         in itertools.product(protocols, interferences, tx_powers, channels)),
+        key=lambda config: (config.tx_power, config.channel,
+                            config.protocol, config.interference != "None",
+                            config.interference))
+
+
+def check_node_sets(node_sets, scrambler_id):
+    """
+    Raises ValueError if node sets are not disjoint,
+    or if one of them contains the scrambler
+    """
+    seen = set()
+    for node_set in node_sets:
+        nodes = set(node_set.node_ids)
+        if nodes & seen:
+            raise ValueError(f"node sets overlap on {sorted(nodes & seen)}")
+        if scrambler_id in nodes:
+            raise ValueError(f"scrambler {scrambler_id} cannot be"
+                             f" in a node set")
+        seen |= nodes
+
+
+def _compatible(config, wave):
+    """
+    Can config run at the same time as all configs in wave
+    """
+    for other, _ in wave:
+        if channels_overlap(config.channel, other.channel):
+            return False
+        # there's only one scrambler
+        if config.interference != "None" and other.interference != "None":
+            return False
+    return True
+
+
+def plan_waves(configs, node_sets):
+    """
+    Cut a list of configs into waves; in a wave:
+    * each node set is used by at most one config
+    * the channels do not overlap
+    * at most one config uses the scrambler
+
+    Configs are considered in the incoming order, with a greedy first-fit,
+    so with a single node set the result is one config per wave,
+    in the same order
+
+    Returns a list of waves, each wave being a list of (config, node_set)
+    """
+    pending = list(configs)
+    waves = []
+    while pending:
+        wave, remaining = [], []
+        for config in pending:
+            if len(wave) < len(node_sets) and _compatible(config, wave):
+                wave.append((config, node_sets[len(wave)]))
+            else:
+                remaining.append(config)
+        waves.append(wave)
+        pending = remaining
+    return waves
+
+
+def make_node_sets(node_id_lists, *, src_ids, dest_ids):
+    """
+    Builds NodeSet instances from lists of node ids; in each set,
+    the sources (resp. destinations) are the ones in src_ids
+    (resp. dest_ids) that belong in the set, or all its nodes if none does
+    """
+    node_sets = []
+    for node_ids in node_id_lists:
+        node_ids = [int(id) for id in node_ids]
+        node_sets.append(NodeSet(
+            node_ids,
+            [int(id) for id in src_ids if int(id) in node_ids] or node_ids,
+            [int(id) for id in dest_ids if int(id) in node_ids] or node_ids))
+    return node_sets
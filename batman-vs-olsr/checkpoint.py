@@ -0,0 +1,84 @@
+# pylint: disable=c0111
+"""
+    Keeping track of the progress of a campaign
+
+    A campaign writes a checkpoint.json in its run_name directory,
+    with one entry per run directory; a run directory is recorded as
+    complete only once all the files it is expected to produce are
+    there and valid, so that a resumed campaign can skip it altogether
+
+    This module is shared between the demos that run campaigns,
+    so that they all write and read the checkpoint the same way
+"""
+
+import re
+import json
+from pathlib import Path
+
+CHECKPOINT = "checkpoint.json"
+
+
+def load_checkpoint(run_name):
+    """
+    The contents of run_name/checkpoint.json, as a dictionary
+    directory name -> entry; empty if there is no checkpoint yet
+    """
+    checkpoint_path = Path(run_name) / CHECKPOINT
+    try:
+        with checkpoint_path.open() as feed:
+            return json.load(feed)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint_entry(run_root, entry):
+    """
+    Records entry - a dictionary with at least a 'complete' key -
+    for run_root in the checkpoint of its parent directory
+    """
+    checkpoint = load_checkpoint(run_root.parent)
+    checkpoint[run_root.name] = entry
+    # write and rename, so the checkpoint is never left half-written
+    checkpoint_path = run_root.parent / CHECKPOINT
+    partial = checkpoint_path.with_name(CHECKPOINT + ".part")
+    with partial.open('w') as feed:
+        json.dump(checkpoint, feed, indent=2, sort_keys=True)
+        feed.write("\n")
+    partial.replace(checkpoint_path)
+
+
+def completed_runs(run_name):
+    """
+    The set of directory names recorded as complete in the checkpoint
+    """
+    return {directory
+            for directory, entry in load_checkpoint(run_name).items()
+            if entry.get('complete')}
+
+
+# the summary that ping writes once it is done; my-ping in
+# radiomap prefixes it with the hostname and destination
+ping_statistics_line = (
+    r'(?P<transmitted>[0-9]+) packets transmitted'
+)
+
+
+def ping_file_complete(filename, *, header_line=None):
+    """
+    Whether a PING file was written out entirely, i.e. it has the
+    statistics from ping, and also the header line if header_line is
+    set - the regexp for that line comes with each demo's PING format;
+    a ping that lost all its packets is complete nonetheless
+    """
+    header = header_line is None
+    statistics = False
+    try:
+        with open(filename) as ping_file:
+            for line in ping_file:
+                if not header and re.match(header_line, line):
+                    header = True
+                elif re.search(ping_statistics_line, line):
+                    statistics = True
+    except (IOError, UnicodeDecodeError):
+        return False
+    return header and statistics
@@ -25,3 +25,7 @@ DEFAULT_SCRAMBLER_ID = 5
 DEFAULT_NODE_IDS = [1, 4, 12, 14, 19, 27, 31, 33, 37]
 DEFAULT_SRC_IDS = [1]
 DEFAULT_DEST_IDS = [37]
+
+# route-sample-service.sh takes one sample of the routing table
+# every half second
+ROUTE_SAMPLE_PERIOD = 0.5
@@ -1,5 +1,7 @@
 from operator import le, lt
 
+import numpy as np
+
 class CustomColors:
     """
     A little smarter colormap than the linear model offered in bokeh.
@@ -44,6 +46,25 @@ class CustomColors:
                 return color
         return self.colors[-1]
 
+    def colors_for(self, values):
+        """
+        vectorized version of color()
+
+        values is an array-like of numbers;
+        returns a numpy array of the same shape with the colors
+        """
+        values = np.asarray(values)
+        ticks = np.array([tick for tick, _ in self.ticks])
+        rights = np.array([side == 'right' for _, side in self.ticks])
+        # the number of ticks strictly below each value
+        indices = np.searchsorted(ticks, values, side='left')
+        # a value that sits exactly on a 'right' tick
+        # gets the color for the area above
+        clipped = np.minimum(indices, len(ticks) - 1)
+        indices += (indices < len(ticks)) \
+            & (ticks[clipped] == values) & rights[clipped]
+        return np.asarray(self.colors, dtype=object)[indices]
+
 
 def test():
 
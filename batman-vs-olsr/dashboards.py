@@ -18,7 +18,7 @@ from ipywidgets import (fixed, Dropdown, Layout, HBox, VBox, Text,
 from IPython.display import display
 
 # import a dictionary channel -> frequency
-from datastore import naming_scheme, receiver_nodes, sender_nodes
+from datastore import run_exists, receiver_nodes, sender_nodes
 from channels import channel_options
 from constants import CHOICES_INTERFERENCE
 
@@ -37,9 +37,8 @@ def available_interference_options(datadir):
         str(interference): interference
         for interference in INTERFERENCE_OPTIONS.keys()
         if any(
-            naming_scheme(run_name=datadir, protocol=protocol,
-                          interference=interference,
-                          autocreate=False).exists()
+            run_exists(run_name=datadir, protocol=protocol,
+                       interference=interference)
             for protocol in ('batman', 'olsr'))
     }
 
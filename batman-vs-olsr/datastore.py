@@ -2,12 +2,19 @@
 
 # pylint: disable=c0111, c0103, w0511, r0913, r0914, r1710
 
+import os
 import sys
 import re
+import json
+import tempfile
 from pathlib import Path
 from datetime import datetime
 
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
 
 # should go away eventually
 import glob
@@ -23,17 +30,21 @@ from constants import (
 
 # all parameters must be named
 def naming_scheme(*, run_name, protocol, interference,
+                  tx_power=TX_POWER, phy_rate=PHY_RATE,
+                  antenna_mask=ANTENNA_MASK, channel=CHANNEL,
                   autocreate=False):
     """
     Returns a pathlib Path instance that points at the directory
     where all tmp files and results are stored for those settings
 
+    The wireless settings default to the constant ones
+
     if autocreate is set to True, the directory is created if needed,
     and a message is printed in that case
     """
     root = Path(run_name)
-    run_root = root / (f"t{TX_POWER}-r{PHY_RATE}-a{ANTENNA_MASK}"
-                       f"-ch{CHANNEL}-I{interference}-{protocol}")
+    run_root = root / (f"t{tx_power}-r{phy_rate}-a{antenna_mask}"
+                       f"-ch{channel}-I{interference}-{protocol}")
     if autocreate:
         if not run_root.is_dir():
             print(f"Creating result directory: {run_root}")
@@ -51,6 +62,17 @@ interference_line = (
 def retrieve_scrambler_id(run_name, protocol, interference):
     root = naming_scheme(run_name=run_name, protocol=protocol,
                          interference=interference)
+    manifest = run_manifest(run_name, root.name)
+    if manifest is not None:
+        return (manifest['scrambler_id']
+                if manifest['interference'] != "None" else None)
+    return _trace_scrambler_id(root)
+
+
+def _trace_scrambler_id(root):
+    """
+    the scrambler id from the trace file - for runs with no run.json
+    """
     traces = root.glob("trace*")
     for tracepath in traces:
         with tracepath.open() as trace:
@@ -62,14 +84,240 @@ def retrieve_scrambler_id(run_name, protocol, interference):
                     return int(scrambler_id) if interference != "None" else None
 
 
+####################
+# one_run writes a run.json manifest in each run directory,
+# and maintains an index.json in the run_name directory
+# that gathers all manifests - without their file inventory;
+# so that the dashboards can read a single file to know
+# what is available in a datadir
+
+RUN_MANIFEST = "run.json"
+RUNS_INDEX = "index.json"
+
+# the part of naming_scheme that is specific to a run
+run_dir_pattern = (
+    r't(?P<tx_power>[0-9]+)-r(?P<phy_rate>[0-9]+)'
+    r'-a(?P<antenna_mask>[0-9]+)-ch(?P<channel>[0-9]+)'
+    r'-I(?P<interference>[\w-]+?)-(?P<protocol>batman|olsr)$'
+)
+
+
+def _write_json(path, contents):
+    # write and rename, so a reader never sees a partial file
+    partial = path.with_name(path.name + ".part")
+    with partial.open('w') as feed:
+        json.dump(contents, feed, indent=2, sort_keys=True)
+        feed.write("\n")
+    partial.replace(path)
+
+
+def legacy_manifest(run_root):
+    """
+    A minimal manifest for a run directory that has no run.json,
+    from the directory name and the trace file
+
+    Returns None if run_root does not look like a run directory
+    """
+    match = re.match(run_dir_pattern, run_root.name)
+    if not match:
+        return None
+    manifest = match.groupdict()
+    for key in ('tx_power', 'phy_rate', 'antenna_mask', 'channel'):
+        manifest[key] = int(manifest[key])
+    manifest['directory'] = run_root.name
+    manifest['scrambler_id'] = _trace_scrambler_id(run_root)
+    return manifest
+
+
+def save_run_manifest(run_root, manifest):
+    """
+    Writes run_root/run.json, and records it in the
+    index.json of the parent directory
+
+    The first time an index is created, the runs already
+    in that directory are indexed as well
+    """
+    _write_json(run_root / RUN_MANIFEST, manifest)
+    index_path = run_root.parent / RUNS_INDEX
+    if index_path.exists():
+        with index_path.open() as feed:
+            index = json.load(feed)
+    else:
+        index = {}
+        for subdir in run_root.parent.iterdir():
+            if subdir.is_dir():
+                legacy = legacy_manifest(subdir)
+                if legacy is not None:
+                    index[subdir.name] = legacy
+    entry = {key: value for key, value in manifest.items() if key != 'files'}
+    index[run_root.name] = entry
+    _write_json(index_path, index)
+
+
+# run_name -> (mtime, index)
+_runs_indexes = {}
+
+def load_runs_index(run_name):
+    """
+    The contents of run_name/index.json, as a dictionary
+    directory name -> manifest; read once as long as the file is unchanged
+
+    Returns None if there is no index - typically for older runs
+    """
+    index_path = Path(run_name) / RUNS_INDEX
+    try:
+        mtime = index_path.stat().st_mtime
+    except OSError:
+        return None
+    cached = _runs_indexes.get(str(run_name))
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with index_path.open() as feed:
+        index = json.load(feed)
+    _runs_indexes[str(run_name)] = (mtime, index)
+    return index
+
+
+def run_manifest(run_name, directory):
+    """
+    The manifest for directory - a name as returned by naming_scheme -
+    from the run_name index, or None if not indexed
+    """
+    index = load_runs_index(run_name)
+    if index is None:
+        return None
+    return index.get(directory)
+
+
+def run_exists(*, run_name, protocol, interference):
+    """
+    Whether some data is available for these settings,
+    using the index if there is one
+    """
+    run_root = naming_scheme(run_name=run_name, protocol=protocol,
+                             interference=interference)
+    index = load_runs_index(run_name)
+    if index is not None:
+        return run_root.name in index
+    return run_root.name in catalog(run_name).runs()
+
+
+####################
+# a catalog of what is available in a datadir, built with a single
+# scandir pass, and refreshed only for the subdirs that have changed
+
+ping_file_name = r'PING-(?P<source>[0-9]{2})-(?P<destination>[0-9]{2})$'
+routes_file_name = r'ROUTES-(?P<node>[0-9]{2})$'
+
+# pairs: the set of (source, destination) with a PING file
+# routes: the set of nodes with a ROUTES file
+# newest_ping: the most recent mtime of the PING files, 0 if none
+RunFiles = namedtuple('RunFiles', ['pairs', 'routes', 'newest_ping'])
+
+
+class Catalog:
+    """
+    The contents of a datadir, i.e. for each subdirectory
+    the available pings and routes
+
+    refresh() rescans a subdirectory only if its mtime has changed
+    """
+
+    def __init__(self, run_name):
+        self.root = Path(run_name)
+        # subdir name -> (mtime, RunFiles)
+        self._runs = {}
+
+    @staticmethod
+    def _scan_run(path):
+        pairs, routes = set(), set()
+        newest_ping = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                match = re.match(ping_file_name, entry.name)
+                if match:
+                    pairs.add((int(match.group('source')),
+                               int(match.group('destination'))))
+                    newest_ping = max(newest_ping, entry.stat().st_mtime)
+                    continue
+                match = re.match(routes_file_name, entry.name)
+                if match:
+                    routes.add(int(match.group('node')))
+        return RunFiles(pairs, routes, newest_ping)
+
+    def refresh(self):
+        runs = {}
+        try:
+            with os.scandir(self.root) as entries:
+                subdirs = [entry for entry in entries if entry.is_dir()]
+        except OSError:
+            subdirs = []
+        for entry in subdirs:
+            mtime = entry.stat().st_mtime
+            known = self._runs.get(entry.name)
+            if known is not None and known[0] == mtime:
+                runs[entry.name] = known
+            else:
+                runs[entry.name] = (mtime, self._scan_run(entry.path))
+        self._runs = runs
+        return self
+
+    def runs(self):
+        """
+        A dictionary subdir name -> RunFiles
+        """
+        return {name: files for name, (_, files) in self._runs.items()}
+
+    def newest_ping(self):
+        """
+        The most recent mtime of all PING files, 0 if none
+
+        the subdirs' own mtimes also change when other files are
+        added, like metrics; so the PING files' mtimes are collected
+        when a subdir gets scanned, and only then
+        """
+        return max((files.newest_ping for _, files in self._runs.values()),
+                   default=0)
+
+    def configs(self):
+        """
+        A nested dictionary
+        config -> protocol -> interference -> RunFiles
+        where config is e.g. 't5-r54-a1-ch10', and interference
+        is a string like in CHOICES_INTERFERENCE
+        """
+        configs = defaultdict(lambda: defaultdict(dict))
+        for name, (_, files) in self._runs.items():
+            match = re.match(run_dir_pattern, name)
+            if not match:
+                continue
+            config = name[:name.index("-I")]
+            configs[config][match.group('protocol')][
+                match.group('interference')] = files
+        return configs
+
+
+# run_name -> Catalog
+_catalogs = {}
+
+def catalog(run_name):
+    """
+    The Catalog for run_name, refreshed
+    """
+    key = str(run_name)
+    if key not in _catalogs:
+        _catalogs[key] = Catalog(run_name)
+    return _catalogs[key].refresh()
+
+
 def sender_nodes(run_name):
     """
     Scans directory run_name and returns all nodes that have been
-    the destination of at least one ping
+    the source of at least one ping
     """
-    all_pings = Path(run_name).glob("*/PING-??-??")
-
-    return sorted({ping.name[-5:-3] for ping in all_pings})
+    return sorted({f"{source:02d}"
+                   for files in catalog(run_name).runs().values()
+                   for source, _ in files.pairs})
 
 
 def receiver_nodes(run_name):
@@ -77,9 +325,9 @@ def receiver_nodes(run_name):
     Scans directory run_name and returns all nodes that have been
     the destination of at least one ping
     """
-    all_pings = Path(run_name).glob("*/PING-??-??")
-
-    return sorted({ping.name[-2:] for ping in all_pings})
+    return sorted({f"{destination:02d}"
+                   for files in catalog(run_name).runs().values()
+                   for _, destination in files.pairs})
 
 ####################
 ### helpers
@@ -106,24 +354,56 @@ PingDetails = namedtuple(
     ['PDR', 'RTT'])
 
 
-def read_ping_details(filename, warning=True):
+# how many packets have we tried to send ?
+# this is in the header line written out by my-ping
+ping_header_line = (
+    r'ping .* -c (?P<nb_packets>[0-9]+) .*'
+)
+
+# parse each packet line
+ping_packet_line = (
+    r'.*: '
+    r'icmp_seq=(?P<icmp_seq>[0-9]+) '
+    r'ttl=(?P<ttl>[0-9]+) '
+    r'time=(?P<rtt>[0-9.]+) ms'
+)
+
+
+def parse_ping_file(filename):
     """
-    Return a PingDetails resulting from parsing a PING file
+    Parse a PING file as written out by my-ping
+
+    Returns a tuple nb_packets, packets
+    where packets is a list of Packet instances
+    and nb_packets is None if the header line could not be found
+
+    Raises IOError if the file cannot be read
     """
+    nb_packets = None
+    packets = []
 
-    # how many packets have we tried to send ?
-    # this is in the header line written out by my-ping
-    header_line = (
-        r'ping .* -c (?P<nb_packets>[0-9]+) .*'
-    )
+    with open(filename) as ping_file:
+        for line in ping_file:
+            match = re.match(ping_header_line, line)
+            if match:
+                nb_packets = int(match.group('nb_packets'))
+                continue
 
-    # parse each packet line
-    packet_line = (
-        r'.*: '
-        r'icmp_seq=(?P<icmp_seq>[0-9]+) '
-        r'ttl=(?P<ttl>[0-9]+) '
-        r'time=(?P<rtt>[0-9.]+) ms'
-    )
+            match = re.match(ping_packet_line, line)
+            if match:
+                packets.append(Packet(
+                    icmp_seq=int(match.group('icmp_seq')),
+                    rtt=float(match.group('rtt')),
+                ))
+                continue
+
+    return nb_packets, packets
+
+
+def read_ping_details(filename, warning=True):
+    """
+    Return a PingDetails resulting from parsing a PING file
+    """
 
     nb_packets = None
     packets = []
@@ -132,20 +412,7 @@ def read_ping_details(filename, warning=True):
     oops = PingDetails(PDR=1., RTT=10**10)
 
     try:
-        with open(filename) as ping_file:
-            for line in ping_file:
-                match = re.match(header_line, line)
-                if match:
-                    nb_packets = int(match.group('nb_packets'))
-                    continue
-
-                match = re.match(packet_line, line)
-                if match:
-                    packets.append(Packet(
-                        icmp_seq=int(match.group('icmp_seq')),
-                        rtt=float(match.group('rtt')),
-                    ))
-                    continue
+        nb_packets, packets = parse_ping_file(filename)
 
     except IOError:
         if warning:
@@ -154,7 +421,7 @@ def read_ping_details(filename, warning=True):
                   .format(path.name, path.parent))
 
     if not nb_packets:
-        print("OOPS, {filename} has no header line, can't figure nb_packets")
+        print(f"OOPS, {filename} has no header line, can't figure nb_packets")
         return oops
 
     if not packets:
@@ -168,6 +435,219 @@ def read_ping_details(filename, warning=True):
     return PingDetails(RTT=rtt, PDR=pdr)
 
 
+####################
+# a columnar store for all the PING files in a run_name
+#
+# the dashboards need to read dozens of PING files each time
+# a slider is moved; ingest_pings() parses all the PING files
+# found in a run_name - i.e. all protocols and interferences -
+# once and for all, and stores the result in a single PINGS.npz
+# file at the top of run_name;
+# load_pings() then reads that file back in one go
+#
+# in the store, all packets are stored in the icmp_seq and rtt
+# arrays, sorted by pair; the packets for pair i are found between
+# pair_offset[i] and pair_offset[i+1]
+
+PINGS_STORE = "PINGS.npz"
+
+
+def ingest_pings(run_name):
+    """
+    Parse all the PING-SS-DD files in all the subdirectories
+    of run_name, and store them in run_name/PINGS.npz
+
+    Returns the path of the store
+    """
+    configs = []
+    pair_config, pair_source, pair_destination = [], [], []
+    pair_nb_packets, pair_offset = [], [0]
+    icmp_seqs, rtts = [], []
+
+    for config, files in sorted(catalog(run_name).runs().items()):
+        config_index = len(configs)
+        configs.append(config)
+        for source, destination in sorted(files.pairs):
+            ping_path = (Path(run_name) / config
+                         / f"PING-{source:02d}-{destination:02d}")
+            try:
+                nb_packets, packets = parse_ping_file(ping_path)
+            except IOError as exc:
+                print(f"Cannot read {ping_path} - ignored - {exc}")
+                continue
+            pair_config.append(config_index)
+            pair_source.append(source)
+            pair_destination.append(destination)
+            pair_nb_packets.append(nb_packets or 0)
+            icmp_seqs.extend(packet.icmp_seq for packet in packets)
+            rtts.extend(packet.rtt for packet in packets)
+            pair_offset.append(len(rtts))
+
+    store = Path(run_name) / PINGS_STORE
+    # plain savez so the store gets written uncompressed
+    np.savez(store,
+             configs=np.array(configs, dtype=str),
+             pair_config=np.array(pair_config, dtype=np.int16),
+             pair_source=np.array(pair_source, dtype=np.int16),
+             pair_destination=np.array(pair_destination, dtype=np.int16),
+             pair_nb_packets=np.array(pair_nb_packets, dtype=np.int32),
+             pair_offset=np.array(pair_offset, dtype=np.int64),
+             icmp_seq=np.array(icmp_seqs, dtype=np.int32),
+             rtt=np.array(rtts, dtype=np.float32))
+    time_line(f"stored {len(pair_source)} pings from"
+              f" {len(configs)} configs in {store}")
+    return store
+
+
+# the percentiles computed on RTTs
+RTT_PERCENTILES = (50, 90, 99)
+
+PingMatrices = namedtuple(
+    'PingMatrices',
+    ['PDR', 'RTT', 'RTT_PERCENTILES', 'JITTER'])
+
+
+class PingStore:
+    """
+    The in-memory contents of a PINGS.npz file
+
+    Matrices are indexed by node ids, i.e. matrix[source, destination]
+    and PDR and RTT follow the same conventions as details_from_all_senders:
+
+      * PDR=-1 and RTT=0 on the diagonal
+      * PDR=1 and RTT=10**10 for pairs that were not measured,
+        or where no packet made it
+
+    RTT_PERCENTILES has an extra dimension, one for each value
+    in RTT_PERCENTILES; JITTER is the mean absolute difference
+    between the RTTs of consecutive packets; these two are
+    NaN when undefined
+    """
+
+    def __init__(self, arrays):
+        # materialize all arrays once
+        for name in arrays.files:
+            setattr(self, name, arrays[name])
+        self.config_index = {
+            config: index for index, config in enumerate(self.configs)}
+        self.nb_packets_received = np.diff(self.pair_offset)
+        # so that the rtt sum for any pair is a mere difference
+        self.rtt_cumsum = np.concatenate(
+            ([0.], np.cumsum(self.rtt, dtype=np.float64)))
+        # node ids are used as indices; r2lab has 37 nodes
+        self.size = 1 + max(37, self.pair_source.max(initial=0),
+                            self.pair_destination.max(initial=0))
+        # config -> PingMatrices
+        self._matrices = {}
+
+    def config_pairs(self, config):
+        """
+        Returns the indices of the pairs for that config,
+        config being a directory name as returned by naming_scheme()
+        """
+        try:
+            index = self.config_index[config]
+        except KeyError:
+            return np.array([], dtype=np.int64)
+        return np.flatnonzero(self.pair_config == index)
+
+    def matrices(self, config):
+        """
+        Returns a PingMatrices tuple of (size x size) arrays for that config
+
+        Results are computed once for all pairs, and then cached
+        """
+        if config not in self._matrices:
+            self._matrices[config] = self._compute_matrices(config)
+        return self._matrices[config]
+
+    def _compute_matrices(self, config):
+        size = self.size
+        pdr = np.ones((size, size))
+        rtt = np.full((size, size), 10.**10)
+        percentiles = np.full((size, size, len(RTT_PERCENTILES)), np.nan)
+        jitter = np.full((size, size), np.nan)
+
+        pairs = self.config_pairs(config)
+        received = self.nb_packets_received[pairs]
+        # pairs with no header or no packet keep the default values
+        ok = (self.pair_nb_packets[pairs] > 0) & (received > 0)
+        pairs, received = pairs[ok], received[ok]
+        sources = self.pair_source[pairs]
+        destinations = self.pair_destination[pairs]
+        starts, stops = self.pair_offset[pairs], self.pair_offset[pairs + 1]
+
+        pdr[sources, destinations] = (
+            1 - received / self.pair_nb_packets[pairs])
+        rtt_sums = self.rtt_cumsum[stops] - self.rtt_cumsum[starts]
+        rtt[sources, destinations] = rtt_sums / received
+
+        if len(pairs):
+            # gather the packets of all selected pairs in one array,
+            # where segment i holds the packets of pairs[i]
+            segment_starts = np.concatenate(([0], np.cumsum(received)[:-1]))
+            packet_indices = (np.repeat(starts - segment_starts, received)
+                              + np.arange(received.sum()))
+            segment_ids = np.repeat(np.arange(len(pairs)), received)
+            rtts = self.rtt[packet_indices].astype(np.float64)
+
+            # jitter: consecutive packets within the same segment
+            deltas = np.abs(np.diff(rtts))
+            deltas[segment_ids[1:] != segment_ids[:-1]] = 0.
+            deltas_cumsum = np.concatenate(([0.], np.cumsum(deltas)))
+            # the sum of deltas over a segment is
+            # cumsum[last packet] - cumsum[first packet]
+            delta_sums = (deltas_cumsum[segment_starts + received - 1]
+                          - deltas_cumsum[segment_starts])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                jitter[sources, destinations] = np.where(
+                    received > 1, delta_sums / (received - 1), np.nan)
+
+            # percentiles: sort by segment, then by rtt
+            sorted_rtts = rtts[np.lexsort((rtts, segment_ids))]
+            # linear interpolation, like np.percentile does
+            positions = (np.array(RTT_PERCENTILES)[np.newaxis, :] / 100
+                         * (received[:, np.newaxis] - 1))
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.ceil(positions).astype(np.int64)
+            base = segment_starts[:, np.newaxis]
+            low_values = sorted_rtts[base + lower]
+            high_values = sorted_rtts[base + upper]
+            percentiles[sources, destinations] = (
+                low_values + (high_values - low_values) * (positions - lower))
+
+        np.fill_diagonal(pdr, -1)
+        np.fill_diagonal(rtt, 0.)
+        return PingMatrices(PDR=pdr, RTT=rtt,
+                            RTT_PERCENTILES=percentiles, JITTER=jitter)
+
+
+# path -> (mtime, PingStore)
+_ping_stores = {}
+
+
+def load_pings(run_name, autoingest=True):
+    """
+    Returns a PingStore instance for that run_name
+
+    The store gets (re)created if it is missing or older than
+    one of the PING files, unless autoingest is False;
+    loaded stores are cached in memory until the file changes
+    """
+    store = Path(run_name) / PINGS_STORE
+    if autoingest:
+        newest = catalog(run_name).newest_ping()
+        if not store.exists() or store.stat().st_mtime < newest:
+            ingest_pings(run_name)
+    mtime = store.stat().st_mtime
+    cached_mtime, ping_store = _ping_stores.get(str(store), (None, None))
+    if cached_mtime != mtime:
+        with np.load(store) as arrays:
+            ping_store = PingStore(arrays)
+        _ping_stores[str(store)] = (mtime, ping_store)
+    return ping_store
+
+
 ####################
 from customcolors import CustomColors
 from bokeh.palettes import Viridis
@@ -183,6 +663,18 @@ RTT_COLORS = CustomColors(
     # we need one more color than ticks
     colors=['red'] + list(reversed(Viridis[8])))
 
+def ping_matrices(run_name, protocol, interference):
+    """
+    Returns a PingMatrices instance with the PDR, RTT, RTT percentiles
+    and jitter for all (source, destination) couples in these conditions
+
+    All PING files in run_name are parsed only once, see load_pings()
+    """
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    return load_pings(run_name).matrices(directory.name)
+
+
 def details_from_all_senders(dataframe, run_name,
                              protocol, interference,
                              destination_id, sources):
@@ -191,23 +683,18 @@ def details_from_all_senders(dataframe, run_name,
     for all sender nodes to this receiver node
     """
 
-    directory = naming_scheme(run_name=run_name, protocol=protocol,
-                              interference=interference)
+    matrices = ping_matrices(run_name, protocol, interference)
+    sources = list(sources)
+    pdrs = matrices.PDR[sources, destination_id]
+    rtts = matrices.RTT[sources, destination_id]
 
-    for source_id in sources:
-        if source_id == destination_id:
-            ping_details = PingDetails(PDR=-1, RTT=0.)
-        else:
-            ping_filename = (
-                directory / f"PING-{source_id:02d}-{destination_id:02d}")
-            ping_details = read_ping_details(ping_filename)
-        dataframe.loc[source_id]['PDR'] = ping_details.PDR
-        dataframe.loc[source_id]['RTT'] = ping_details.RTT
-        # I could not get bokeh's colormapper system to
-        # work exactly for me, so let's apply a home-made mapper
-        # and store the result in separate columns
-        dataframe.loc[source_id]['PDRC'] = PDR_COLORS.color(ping_details.PDR)
-        dataframe.loc[source_id]['RTTC'] = RTT_COLORS.color(ping_details.RTT)
+    dataframe.loc[sources, 'PDR'] = pdrs
+    dataframe.loc[sources, 'RTT'] = rtts
+    # I could not get bokeh's colormapper system to
+    # work exactly for me, so let's apply a home-made mapper
+    # and store the result in separate columns
+    dataframe.loc[sources, 'PDRC'] = PDR_COLORS.colors_for(pdrs)
+    dataframe.loc[sources, 'RTTC'] = RTT_COLORS.colors_for(rtts)
 
 
 
@@ -259,10 +746,16 @@ def get_edges_from_routes(dot, routes):
     return dot
 
 
+# the map is static, no need to create one per graph
+@lru_cache(maxsize=None)
+def _r2labmap():
+    return R2labMap()
+
+
 def routing_graph(run_name, interference,
                   source, protocol):
     scrambler_id = retrieve_scrambler_id(run_name, protocol, interference)
-    r2labmap = R2labMap()
+    r2labmap = _r2labmap()
     dot = Digraph(comment=f'Routing table for fit{source:02d}',
                   engine='fdp')
     dot.attr('graph', label=protocol)
@@ -309,3 +802,115 @@ def routing_graph(run_name, interference,
         dot = get_edges_from_routes(dot, routes)
 
         return dot
+
+
+####################
+# rendering a routing graph takes a graphviz run, and the notebook
+# shows 2 of them each time the sender slider moves; so renders
+# are kept both in memory and on disk, next to the ROUTES files
+
+ROUTING_GRAPHS_DIR = "GRAPHS"
+ROUTING_GRAPH_CACHE_SIZE = 256
+# the threads for prerender_routing_graphs, shared by all calls
+ROUTING_GRAPH_RENDERERS = 4
+_renderers = ThreadPoolExecutor(max_workers=ROUTING_GRAPH_RENDERERS,
+                                thread_name_prefix="render")
+
+
+class RenderedGraph:
+    """
+    A graph as rendered by graphviz, that displays in a notebook
+    """
+    def __init__(self, data, format):
+        self.data = data
+        self.format = format
+
+    def _repr_svg_(self):
+        return self.data.decode() if self.format == 'svg' else None
+
+    def _repr_png_(self):
+        return self.data if self.format == 'png' else None
+
+
+def _routing_graph_inputs(run_name, protocol, interference, source):
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    return [directory / "ROUTES-{:02d}".format(source),
+            *sorted(directory.glob("trace*"))]
+
+
+def _mtimes(paths):
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(path.stat().st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+# mtimes is only there so that a changed input is a different key
+@lru_cache(maxsize=ROUTING_GRAPH_CACHE_SIZE)
+def _rendered_routing_graph(run_name, protocol, interference, source,
+                            format, mtimes):
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    rendered = (directory / ROUTING_GRAPHS_DIR
+                / "ROUTES-{:02d}.{}".format(source, format))
+    newest_input = max((mtime for mtime in mtimes if mtime is not None),
+                       default=0)
+    try:
+        if rendered.stat().st_mtime >= newest_input:
+            return rendered.read_bytes()
+    except OSError:
+        pass
+    dot = routing_graph(run_name, interference, source, protocol)
+    if dot is None:
+        return None
+    data = dot.pipe(format=format)
+    # the on-disk copy is only an optimization, e.g. datadir may be read-only
+    try:
+        rendered.parent.mkdir(exist_ok=True)
+        # write and rename, other threads or processes may be
+        # rendering the same graph, so each one has its own temp file
+        with tempfile.NamedTemporaryFile(
+                dir=str(rendered.parent), prefix=rendered.name + ".",
+                suffix=".part", delete=False) as partial:
+            partial.write(data)
+        Path(partial.name).replace(rendered)
+    except OSError:
+        pass
+    return data
+
+
+def cached_routing_graph(run_name, interference, source, protocol,
+                         *, format='svg'):
+    """
+    Same as routing_graph, but returns a RenderedGraph - or None -
+    that is rendered only once per set of inputs; a render gets
+    redone if the ROUTES file or the trace file are changed
+    """
+    mtimes = _mtimes(_routing_graph_inputs(
+        run_name, protocol, interference, source))
+    data = _rendered_routing_graph(str(run_name), protocol, str(interference),
+                                   source, format, mtimes)
+    return None if data is None else RenderedGraph(data, format)
+
+
+def prerender_routing_graphs(run_name, *, interferences, sources,
+                             protocols=('batman', 'olsr'),
+                             format='svg'):
+    """
+    Renders in the background, with a pool of threads, the graphs for
+    all combinations of interferences, sources and protocols, so that
+    subsequent calls to cached_routing_graph return immediately
+
+    Returns the list of futures, there is no need to wait for them
+    """
+    return [
+        _renderers.submit(cached_routing_graph, run_name, interference,
+                          source, protocol, format=format)
+        for interference in interferences
+        for source in sources
+        for protocol in protocols
+    ]
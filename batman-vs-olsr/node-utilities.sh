@@ -234,6 +234,40 @@ function route-batman (){
     return 0
 }
 
+# wait for the routing table to converge, i.e. to be non-empty
+# and unchanged over $samples consecutive samples, taken every $period s
+# give up after $timeout s, which is not considered an error
+function wait-routes-stable (){
+    local protocol=$1; shift
+    local samples=$1; shift
+    local period=$1; shift
+    local timeout=$1; shift
+
+    local start=$(date +%s)
+    local previous=""
+    local stable=0
+
+    while true; do
+        local current=$(route-$protocol | sort)
+        if [ -n "$current" -a "$current" == "$previous" ]; then
+            stable=$(($stable+1))
+        else
+            stable=0
+        fi
+        previous="$current"
+        local elapsed=$(($(date +%s)-$start))
+        if [ $stable -ge $samples ]; then
+            echo "$protocol routes stable after $elapsed s"
+            return 0
+        fi
+        if [ $elapsed -ge $timeout ]; then
+            echo "$protocol routes still moving after $elapsed s - giving up"
+            return 0
+        fi
+        sleep $period
+    done
+}
+
 function route-sample-batman(){
     sample=0
 
@@ -291,6 +325,29 @@ function my-ping (){
     return 0
 }
 
+# run my-ping towards several destinations, and gather
+# all the resulting PING-SS-DD files in a single archive
+# so that they can be retrieved in one go
+function my-pings (){
+    local source=$1; shift
+    local timeout=$1; shift
+    local interval=$1; shift
+    local size=$1; shift
+    local number=$1; shift
+    local archive=$1; shift
+    local files=""
+
+    for dest in "$@"; do
+        local output=$(printf "PING-%02d-%02d" $source $dest)
+        my-ping 10.0.0.$dest $timeout $interval $size $number \
+                "actual $source ➡︎ $dest" > $output
+        files="$files $output"
+    done
+
+    tar -czf "$archive" $files || return 1
+    return 0
+}
+
 function process-pcap (){
     path=$1; shift
     node=$1; shift
@@ -300,6 +357,37 @@ function process-pcap (){
     return 0
 }
 
+# tshark is not installed at init-time, see init-ad-hoc-network;
+# it needs to come with the image
+function check-tshark (){
+    node=$1; shift
+    type tshark >& /dev/null || {
+        echo "tshark not found on node fit$node - use an image that has it, or --full-pcap"
+        return 1
+    }
+    return 0
+}
+
+# reduce a capture on the node itself, so that only a small file
+# needs to be retrieved: the same ip.src ip.dst radiotap.dbm_antsignal
+# triples as when parsing the pcap on the laptop, gzipped
+function reduce-pcap (){
+    pcap=$1; shift
+    node=$1; shift
+    output=$1; shift
+
+    check-tshark $node || return 1
+    echo "Reducing $pcap on node fit$node"
+    # so that a tshark failure is not hidden by gzip
+    set -o pipefail
+    tshark -2 -r "$pcap" -R "ip.dst==10.0.0.$node && icmp && radiotap.dbm_antsignal" \
+           -Tfields -e "ip.src" -e "ip.dst" -e "radiotap.dbm_antsignal" \
+        | gzip > "$output"
+    local status=$?
+    ls -l "$pcap" "$output"
+    return $status
+}
+
 #function run-tcpdump (){
 #    driver=$1; shift
 #    node=$1; shift
@@ -0,0 +1,132 @@
+# pylint: disable=c0111
+"""
+    Reconstruct the paths between all pairs of nodes
+    from a next-hop matrix, as built by processroute
+    from the ROUTE-TABLE files
+
+    next_hops[source, dest] is the next hop from source to dest,
+    0 meaning that source has no route to dest
+
+    A path follows the next hops until the one towards dest is dest
+    itself; it stops early on a node with no route, in which case
+    the last hop is 0, and on a node that was already visited,
+    in which case the path is a loop
+"""
+
+from collections import namedtuple
+
+#
+# hops: the intermediate hops, i.e. neither source nor dest
+#       for a loop, this ends with the node seen twice
+# loop: True if the path is a loop
+# loop_start: the node seen twice, None if not a loop
+#
+Path = namedtuple('Path', ['hops', 'loop', 'loop_start'])
+
+
+def route_line(source, dest, path):
+    """
+    The line for this path in a ROUTES file, e.g.
+
+        1 -- 14 -- 33              (14 is the only intermediate hop)
+        1 -- 0 -- 33               (no route)
+        1 -- 4 -- 12 -- 4 -- -1 -- 33    (loop through 4 and 12)
+    """
+    line = "{} --".format(source)
+    for hop in path.hops:
+        line += " {} --".format(hop)
+    if path.loop:
+        line += " {} --".format("-1")
+    line += " {}".format(dest)
+    return line
+
+
+class PathEngine:
+    """
+    Computes the paths from a next-hop matrix, typically
+    a numpy array indexed by node ids
+
+    Paths to a given destination are memoized per node, so that
+    the paths from all sources share their common suffixes,
+    and each node is walked only once per destination
+
+    cache is an optional dictionary that can be shared between
+    several engines, e.g. one per sample of the same run;
+    the paths to dest only depend on the dest column of the matrix,
+    so a column that does not change is not walked again
+    """
+
+    def __init__(self, next_hops, *, cache=None):
+        self.next_hops = next_hops
+        self.size = len(next_hops)
+        self.cache = cache if cache is not None else {}
+        self._paths = {}
+
+    def next_hop(self, node, dest):
+        # unknown nodes have no route
+        if node >= self.size:
+            return 0
+        return int(self.next_hops[node, dest])
+
+    def paths_to(self, dest):
+        """
+        The dictionary node -> Path for all paths to dest
+        computed so far; it gets filled by path()
+        """
+        if dest not in self._paths:
+            key = dest, self.next_hops[:, dest].tobytes()
+            self._paths[dest] = self.cache.setdefault(key, {})
+        return self._paths[dest]
+
+    def path(self, source, dest):
+        """
+        The Path from source to dest
+        """
+        paths = self.paths_to(dest)
+        if source in paths:
+            return paths[source]
+        # the nodes walked from source whose path is not known yet,
+        # and their index in that list
+        trail = []
+        position = {}
+        node = source
+        while node not in paths:
+            position[node] = len(trail)
+            trail.append(node)
+            hop = self.next_hop(node, dest)
+            if hop == dest:
+                paths[node] = Path((), False, None)
+                break
+            if hop == 0:
+                paths[node] = Path((0,), False, None)
+                break
+            if hop in position:
+                # all nodes on the cycle loop back to themselves
+                cycle = trail[position[hop]:]
+                for index, looping in enumerate(cycle):
+                    hops = cycle[index+1:] + cycle[:index+1]
+                    paths[looping] = Path(tuple(hops), True, looping)
+                break
+            node = hop
+        # the other nodes in the trail prepend their next hop
+        # to the path of that next hop
+        for node in reversed(trail):
+            if node in paths:
+                continue
+            hop = self.next_hop(node, dest)
+            suffix = paths[hop]
+            paths[node] = Path((hop,) + suffix.hops,
+                               suffix.loop, suffix.loop_start)
+        return paths[source]
+
+    def all_paths(self, sources, dests):
+        """
+        A dictionary (source, dest) -> Path
+        for all pairs of distinct nodes
+        """
+        return {
+            (source, dest): self.path(source, dest)
+            for source in sources
+            for dest in dests
+            if source != dest
+        }
@@ -0,0 +1,274 @@
+# pylint: disable=c0111
+"""
+A streaming reader for the pcap files captured with
+tcpdump -y ieee802_11_radio, that extracts the same triples as
+
+    tshark -2 -r fitN.pcap -R "ip.dst==10.0.0.N && icmp" \\
+        -Tfields -e ip.src -e ip.dst -e radiotap.dbm_antsignal
+
+i.e. for each ICMP over IPv4 packet, its source and destination
+and the dBm antenna signal values found in its radiotap header:
+the combined one first, then one per antenna
+
+Files are memory-mapped and scanned once, so memory usage does not
+depend on the capture size; to compare with tshark on a given file:
+
+    python3 pcapreader.py fit1.pcap 10.0.0.1
+"""
+
+import sys
+import mmap
+import socket
+import struct
+from collections import namedtuple
+
+# rssi is a tuple of ints
+RssiRecord = namedtuple('RssiRecord', ['src', 'dst', 'rssi'])
+
+PCAP_MAGICS = {
+    # magic number as read in little endian -> byte order
+    0xa1b2c3d4: '<', 0xd4c3b2a1: '>',
+    # same with nanosecond timestamps
+    0xa1b23c4d: '<', 0x4d3cb2a1: '>',
+}
+PCAPNG_MAGIC = 0x0a0d0d0a
+LINKTYPE_RADIOTAP = 127
+
+# radiotap fields in the order of the bits of a present word,
+# as (alignment, size); see https://www.radiotap.org/fields/defined
+RADIOTAP_FIELDS = (
+    (8, 8),             # 0 TSFT
+    (1, 1),             # 1 flags
+    (1, 1),             # 2 rate
+    (2, 4),             # 3 channel
+    (1, 2),             # 4 FHSS
+    (1, 1),             # 5 dBm antenna signal
+    (1, 1),             # 6 dBm antenna noise
+    (2, 2),             # 7 lock quality
+    (2, 2),             # 8 TX attenuation
+    (2, 2),             # 9 dB TX attenuation
+    (1, 1),             # 10 dBm TX power
+    (1, 1),             # 11 antenna
+    (1, 1),             # 12 dB antenna signal
+    (1, 1),             # 13 dB antenna noise
+    (2, 2),             # 14 RX flags
+    (2, 2),             # 15 TX flags
+    (1, 1),             # 16 RTS retries
+    (1, 1),             # 17 data retries
+    (4, 8),             # 18 XChannel
+    (1, 3),             # 19 MCS
+    (4, 8),             # 20 A-MPDU status
+    (2, 12),            # 21 VHT
+    (8, 12),            # 22 timestamp
+    (2, 12),            # 23 HE
+    (2, 12),            # 24 HE-MU
+    (2, 6),             # 25 HE-MU-other-user
+    (1, 1),             # 26 0-length-PSDU
+    (2, 4),             # 27 L-SIG
+)
+DBM_ANTSIGNAL = 5
+RADIOTAP_NAMESPACE = 1 << 29
+VENDOR_NAMESPACE = 1 << 30
+EXT = 1 << 31
+
+# the LLC/SNAP header for IPv4
+LLC_IPV4 = b'\xaa\xaa\x03\x00\x00\x00\x08\x00'
+ICMP = 1
+
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+
+
+def antsignal_offsets(data, start, present, length):
+    """
+    The offsets, relative to start, of the dBm antenna signal values
+    in the radiotap header found at data[start:]; present are
+    the bytes of its present words, and length its overall length
+    """
+    offsets = []
+    offset = 4 + len(present)
+    vendor = False
+    for word, in U32.iter_unpack(present):
+        # the data in a vendor namespace is skipped as a whole
+        # when entering that namespace, see below
+        if not vendor:
+            bits = word & (RADIOTAP_NAMESPACE - 1)
+            while bits:
+                bit = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                if bit >= len(RADIOTAP_FIELDS):
+                    # unknown size, we can't go any further
+                    return offsets
+                alignment, size = RADIOTAP_FIELDS[bit]
+                offset += -offset % alignment
+                if offset + size > length:
+                    return offsets
+                if bit == DBM_ANTSIGNAL:
+                    offsets.append(offset)
+                offset += size
+        if word & VENDOR_NAMESPACE:
+            offset += -offset % 2
+            if offset + 6 > length:
+                return offsets
+            # oui (3 bytes), sub namespace (1 byte), skip length
+            skip_length, = U16.unpack_from(data, start + offset + 4)
+            offset += 6 + skip_length
+            vendor = True
+        elif word & RADIOTAP_NAMESPACE:
+            vendor = False
+    return offsets
+
+
+def radiotap_antsignals(data, start, layouts=None):
+    """
+    The dBm antenna signal values in the radiotap header
+    found at data[start:], as a list of ints
+
+    All the packets captured on a given card have the same layout,
+    so if a dictionary is passed as layouts, it is used to cache
+    the offsets of these values for each set of present words
+    """
+    length, = U16.unpack_from(data, start + 2)
+    # the present words come first, the fields after them
+    end = start + 4
+    while end + 4 <= start + length:
+        end += 4
+        if not data[end - 1] & 0x80:
+            break
+    present = data[start + 4:end]
+    key = present, length
+    offsets = layouts.get(key) if layouts is not None else None
+    if offsets is None:
+        offsets = antsignal_offsets(data, start, present, length)
+        # with a vendor namespace, the layout depends on the data too
+        if layouts is not None and not any(
+                word & VENDOR_NAMESPACE
+                for word, in U32.iter_unpack(present)):
+            layouts[key] = offsets
+    return [data[start + offset] - 256 if data[start + offset] > 127
+            else data[start + offset]
+            for offset in offsets]
+
+
+def icmp_addresses(data, start, end):
+    """
+    For an 802.11 data frame at data[start:end] that carries
+    an ICMP over IPv4 packet, returns the source and destination
+    addresses as 4-byte strings; None otherwise
+    """
+    if end - start < 24:
+        return None
+    frame_control, flags = data[start], data[start + 1]
+    # type data, and not a null function
+    if frame_control & 0x0c != 0x08 or frame_control & 0x40:
+        return None
+    # protected frame
+    if flags & 0x40:
+        return None
+    header = 24
+    # to DS and from DS: 4 addresses
+    if flags & 0x03 == 0x03:
+        header += 6
+    # QoS data
+    if frame_control & 0x80:
+        header += 2
+        # HT control
+        if flags & 0x80:
+            header += 4
+    llc = start + header
+    ip = llc + len(LLC_IPV4)
+    if ip + 20 > end or data[llc:ip] != LLC_IPV4:
+        return None
+    if data[ip] >> 4 != 4 or data[ip + 9] != ICMP:
+        return None
+    return data[ip + 12:ip + 16], data[ip + 16:ip + 20]
+
+
+def rssi_records(filename, *, dst=None):
+    """
+    Yields an RssiRecord for each ICMP over IPv4 packet
+    that has at least one dBm antenna signal value;
+    if dst is set, e.g. "10.0.0.1", only for that destination
+
+    Raises ValueError if filename is not a pcap file with radiotap
+    headers; a truncated last packet - as when tcpdump is killed -
+    is silently ignored
+    """
+    wanted = socket.inet_aton(dst) if dst is not None else None
+    with open(filename, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        with data:
+            if len(data) < 24:
+                return
+            magic, = U32.unpack_from(data, 0)
+            if magic == PCAPNG_MAGIC:
+                raise ValueError(f"{filename}: pcapng is not supported")
+            if magic not in PCAP_MAGICS:
+                raise ValueError(f"{filename}: not a pcap file")
+            byte_order = PCAP_MAGICS[magic]
+            linktype, = struct.unpack_from(byte_order + 'I', data, 20)
+            if linktype & 0xffff != LINKTYPE_RADIOTAP:
+                raise ValueError(f"{filename}: no radiotap headers"
+                                 f" (link type {linktype})")
+            record_header = struct.Struct(byte_order + '8xI4x')
+            size = len(data)
+            layouts = {}
+            offset = 24
+            while offset + 16 <= size:
+                captured, = record_header.unpack_from(data, offset)
+                start = offset + 16
+                offset = start + captured
+                if offset > size:
+                    break
+                if captured < 8:
+                    continue
+                # the radiotap header length is always little endian
+                radiotap_length, = U16.unpack_from(data, start + 2)
+                addresses = icmp_addresses(
+                    data, start + radiotap_length, offset)
+                if addresses is None:
+                    continue
+                source, destination = addresses
+                if wanted is not None and destination != wanted:
+                    continue
+                signals = radiotap_antsignals(data, start, layouts)
+                if signals:
+                    yield RssiRecord(socket.inet_ntoa(source),
+                                     socket.inet_ntoa(destination),
+                                     tuple(signals))
+
+
+def result_line(record):
+    """
+    The line for record in a result-N.txt file, as written by tshark
+    """
+    rssi = ",".join(str(value) for value in record.rssi)
+    return f"{record.src}\t{record.dst}\t{rssi}"
+
+
+def write_results(filename, result_name, *, dst):
+    """
+    Writes in result_name the same contents as tshark
+    would for the packets to dst in filename
+    """
+    with open(result_name, 'w') as result_file:
+        for record in rssi_records(filename, dst=dst):
+            result_file.write(result_line(record) + "\n")
+
+
+def main():
+    if not 2 <= len(sys.argv) <= 3:
+        print(f"Usage: {sys.argv[0]} pcap-file [destination]")
+        return 1
+    dst = sys.argv[2] if len(sys.argv) == 3 else None
+    for record in rssi_records(sys.argv[1], dst=dst):
+        print(result_line(record))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -2,44 +2,101 @@
 helper tools for aggregating (averaging) multiple rssi reports
 """
 
-class Averager:
+import os
+import json
+import asyncio
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from pcapreader import rssi_records
+
+# published along with RSSI.txt, says which nodes' captures
+# have been aggregated so far
+PROGRESS = "RSSI-progress.json"
+
+
+def load_progress(run_root):
     """
-    For each couple (receiver, sender) we gather
-    a number of measurement points that must be averaged
+    Returns the contents of RSSI-progress.json, None if not found
+    """
+    try:
+        with (run_root / PROGRESS).open() as feed:
+            return json.load(feed)
+    except (OSError, ValueError):
+        return None
 
-    this is done through an instance of this Averager class
-    all measurement points will contain one, two or three values
-    depending on the number of antennas
 
-    each measurement point is recorded, and at the end
-    averages returns the right value(s)
+def aggregation_complete(run_root):
+    """
+    Whether RSSI.txt covers all the nodes; runs made before
+    the progress file was introduced are considered complete
     """
+    progress = load_progress(run_root)
+    return progress is None or progress['complete']
 
-    def __init__(self, columns):
-        """
-        number of expected columns
-        """
-        self.number = 0
-        self.columns = columns
-        self.total = [0 for i in range(self.columns)]
 
-    def record_point(self, values):
-        """
-        values should have as many measurements as columns
-        """
-        self.number += 1
-        for i in range(self.columns):
-            self.total[i] += values[i]
+def _publish(path, contents):
+    """
+    Writes contents in path atomically, so that readers
+    never see a partially written file
+    """
+    temporary = path.with_name(path.name + ".tmp")
+    with temporary.open("w") as output:
+        output.write(contents)
+    os.replace(str(temporary), str(path))
+
+
+# in result files, all separators are turned into spaces
+# so that the whole contents can be converted at once
+SEPARATORS = bytes.maketrans(b".,\t\r\n", b"     ")
 
-    def averages(self, default):
-        """
-        once all measurement points have been recorded,
-        they can be averaged
-        """
-        if self.number == 0:
-            return [default for i in range(self.columns)]
-        else:
-            return [self.total[i] / self.number for i in range(self.columns)]
+
+def _parse_lines(text):
+    """
+    the slow path for parse_results, when lines do not all
+    have the same number of values
+    """
+    fields = [line.split() for line in text.splitlines()]
+    fields = [line for line in fields if len(line) == 3]
+    widths = np.array([line[2].count(',') for line in fields], dtype=int)
+    groups = []
+    for width in np.unique(widths):
+        selected = [fields[i] for i in np.flatnonzero(widths == width)]
+        senders = [int(line[0].split('.')[-1]) for line in selected]
+        receivers = [int(line[1].split('.')[-1]) for line in selected]
+        values = [[int(x) for x in line[2].split(',')] for line in selected]
+        groups.append((np.array(senders), np.array(receivers),
+                       np.array(values)))
+    return groups
+
+
+def parse_results(contents):
+    """
+    parses the contents of a result-N.txt file as bytes, i.e. lines like
+        10.0.0.2	10.0.0.1	-50,-52,-55,-60
+    as produced by tshark, into a list of (senders, receivers, values)
+    arrays, one for each number of values per line found in the file
+
+    usually all lines have the same number of values, and the whole
+    file is then tokenized in one call to numpy
+    """
+    if not contents.strip():
+        return []
+    first = contents.split(b"\n", 1)[0]
+    # 8 bytes for the 2 IP addresses
+    width = 8 + first.count(b",") + 1
+    numbers = np.fromstring(contents.translate(SEPARATORS),
+                            dtype=int, sep=" ")
+    rows = numbers.reshape(-1, width) if numbers.size % width == 0 else None
+    # shifted rows would show up as a mismatch in the addresses
+    if rows is not None and \
+       contents.count(b",") == len(rows) * (width - 9) and \
+       (rows[:, :3] == rows[0, :3]).all() and \
+       (rows[:, 4:7] == rows[0, 4:7]).all():
+        return [(rows[:, 3], rows[:, 7], rows[:, 8:])]
+    return _parse_lines(contents.decode())
 
 
 class Aggregator:
@@ -47,6 +104,16 @@ class Aggregator:
     """
     one instance of this class for each call to one_run
     will do the aggregation into RSSI.txt
+
+    for each couple (sender, receiver) we gather a number of
+    measurement points, that contain one value per column, i.e.
+    the combined RSSI and then one per antenna; counts, sums,
+    sums of squares, minima and maxima are kept in numpy arrays
+    indexed by (sender, receiver, column), in the order of node_ids
+
+    the files of each node can be recorded as soon as they are
+    available, see co_record(); RSSI.txt is then published after each
+    node, and RSSI-progress.json tells which receivers are covered
     """
 
     # we could also count the ones in a binary form
@@ -63,35 +130,185 @@ class Aggregator:
         self.node_ids = node_ids
         self.antenna_mask = antenna_mask
         self.nb_antennas = self.mask_to_number[antenna_mask]
-        # internal result is a dicted hashed on
-        # a sender, receiver tuple
-        # value is a counter how_many, total
-        self.RSSI = {
-            (sender, receiver): Averager(self.nb_antennas + 1)
-            for sender in node_ids for receiver in node_ids
-        }
-
-    def run(self):
-        """
-        call at the end of one_run
-        """
-        for sender in self.node_ids:
-            result_name = self.run_root / "result-{}.txt".format(sender)
-            with result_name.open() as result_file:
-                for line in result_file:
-                    sender_ip, receiver_ip, comma_rssis = line.split()
-                    sender_id = int(sender_ip.split('.')[-1])
-                    receiver_id = int(receiver_ip.split('.')[-1])
-                    rssis = [int(x) for x in comma_rssis.split(',')]
-                    averager = self.RSSI[sender_id, receiver_id]
-                    averager.record_point(rssis)
-        # consolidated file is called RSSI.txt
-        aggragate_name = self.run_root / "RSSI.txt"
-        with aggragate_name.open("w") as aggregate_file:
-            for (sender, receiver), averager in self.RSSI.items():
-                default = self.RSSI_MAX if sender == receiver else self.RSSI_MIN
-                avgs = averager.averages(default=default)
+        self.columns = self.nb_antennas + 1
+        # node id, i.e. last byte of the IP address -> index
+        # in the arrays, -1 for unknown nodes
+        self.index = np.full(256, -1)
+        self.index[node_ids] = np.arange(len(node_ids))
+        shape = len(node_ids), len(node_ids)
+        self.counts = np.zeros(shape, dtype=int)
+        self.sums = np.zeros(shape + (self.columns,))
+        self.squares = np.zeros(shape + (self.columns,))
+        self.minima = np.full(shape + (self.columns,), np.inf)
+        self.maxima = np.full(shape + (self.columns,), -np.inf)
+        # the nodes whose file has been recorded
+        self.aggregated = []
+        # co_record() runs in threads
+        self.lock = threading.Lock()
+
+    def record_points(self, senders, receivers, values):
+        """
+        records a batch of measurement points; senders and receivers
+        are arrays of node ids, values has one row per point, with at
+        least as many values as columns - the extra ones are ignored
+
+        points that involve a node not in node_ids are ignored
+        """
+        if not len(senders):
+            return
+        values = np.asarray(values, dtype=float).reshape(len(senders), -1)
+        if values.shape[1] < self.columns:
+            return
+        values = values[:, :self.columns]
+        rows = self.index[np.asarray(senders, dtype=int)]
+        cols = self.index[np.asarray(receivers, dtype=int)]
+        known = (rows >= 0) & (cols >= 0)
+        where = rows[known], cols[known]
+        values = values[known]
+        np.add.at(self.counts, where, 1)
+        np.add.at(self.sums, where, values)
+        np.add.at(self.squares, where, values * values)
+        np.minimum.at(self.minima, where, values)
+        np.maximum.at(self.maxima, where, values)
+
+    def record(self, sender, receiver, rssis):
+        """
+        records one measurement point for (sender, receiver)
+        """
+        self.record_points([sender], [receiver], [rssis])
+
+    def record_result(self, node_id):
+        """
+        reads the result-N.txt file for node_id, as produced by tshark
+        """
+        result_name = self.run_root / "result-{}.txt".format(node_id)
+        with result_name.open('rb') as result_file:
+            for group in parse_results(result_file.read()):
+                self.record_points(*group)
+        self.aggregated.append(node_id)
+
+    def record_pcap(self, receiver):
+        """
+        reads the fitN.pcap file for receiver directly, without tshark
+        """
+        pcap_name = self.run_root / "fit{}.pcap".format(receiver)
+        # group the records by number of values
+        groups = {}
+        for record in rssi_records(
+                pcap_name, dst="10.0.0.{}".format(receiver)):
+            senders, values = groups.setdefault(len(record.rssi), ([], []))
+            senders.append(int(record.src.split('.')[-1]))
+            values.append(record.rssi)
+        for senders, values in groups.values():
+            self.record_points(senders, [receiver] * len(senders), values)
+        self.aggregated.append(receiver)
+
+    def record_results(self):
+        """
+        reads the result-N.txt files as produced by tshark
+        """
+        for node_id in self.node_ids:
+            self.record_result(node_id)
+
+    def record_pcaps(self):
+        """
+        reads the fitN.pcap files directly, without tshark
+        """
+        for receiver in self.node_ids:
+            self.record_pcap(receiver)
+
+    def _record_and_save(self, node_id, from_pcaps):
+        with self.lock:
+            if from_pcaps:
+                self.record_pcap(node_id)
+            else:
+                self.record_result(node_id)
+            self.save()
+
+    async def co_record(self, node_id, from_pcaps=False):
+        """
+        records the file for node_id and publishes the partial
+        RSSI.txt; meant to run as a job right after the file
+        has been retrieved, so the parsing - done in a thread -
+        overlaps with the other retrievals
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, self._record_and_save, node_id, from_pcaps)
+
+    def complete(self):
+        """
+        whether the files of all nodes have been recorded
+        """
+        return set(self.node_ids) <= set(self.aggregated)
+
+    def mask(self):
+        """
+        a boolean array indexed by (sender, receiver), true for the
+        couples whose receiver has been recorded - for the other ones
+        RSSI.txt has the default value
+        """
+        recorded = np.isin(self.node_ids, self.aggregated)
+        return np.broadcast_to(recorded, self.counts.shape)
+
+    def defaults(self):
+        """
+        the value used for couples without any measurement point
+        """
+        defaults = np.full(self.counts.shape, float(self.RSSI_MIN))
+        np.fill_diagonal(defaults, self.RSSI_MAX)
+        return defaults[:, :, np.newaxis]
+
+    def averages(self):
+        """
+        once all measurement points have been recorded,
+        they can be averaged; shape is (senders, receivers, columns)
+        """
+        counts = self.counts[:, :, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, self.sums / counts, self.defaults())
+
+    def variances(self):
+        """
+        the variance of the measurement points,
+        nan for couples without any measurement point
+        """
+        counts = self.counts[:, :, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums / counts
+            return np.maximum(self.squares / counts - means * means, 0)
+
+    def save(self):
+        """
+        publishes the consolidated file, called RSSI.txt,
+        together with RSSI-progress.json
+        """
+        averages = self.averages()
+        lines = []
+        for row, sender in enumerate(self.node_ids):
+            for col, receiver in enumerate(self.node_ids):
                 line = "10.0.0.{:02d}\t10.0.0.{:02d}\t".format(
                     sender, receiver)
-                line += "\t".join("{0:.2f}".format(v) for v in avgs)
-                aggregate_file.write(line + "\n")
+                line += "\t".join("{0:.2f}".format(v)
+                                  for v in averages[row, col])
+                lines.append(line + "\n")
+        _publish(self.run_root / "RSSI.txt", "".join(lines))
+        progress = dict(
+            node_ids=list(self.node_ids),
+            aggregated=[node_id for node_id in self.node_ids
+                        if node_id in self.aggregated],
+            complete=self.complete(),
+            updated=datetime.now().isoformat(timespec='seconds'),
+        )
+        _publish(self.run_root / PROGRESS, json.dumps(progress, indent=2))
+
+    def run(self, from_pcaps=False):
+        """
+        call at the end of one_run; with from_pcaps, the RSSIs are
+        read in the fitN.pcap files instead of the result-N.txt files
+        """
+        if from_pcaps:
+            self.record_pcaps()
+        else:
+            self.record_results()
+        self.save()
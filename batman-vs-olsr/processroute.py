@@ -7,7 +7,101 @@
     different nodes selected to do the pings from
 """
 
+import re
+from collections import namedtuple
+
+import numpy as np
+
 from datastore import time_line
+from pathengine import PathEngine, route_line
+
+# the last byte of the addresses is the node id
+route_address = r"\d+\.\d+\.\d+\.(\d+)\s+"
+# ip route ls table 66 - direct routes have no 'via'
+# 10.0.0.27 via 10.0.0.19 dev atheros  proto static  src 10.0.0.12
+# 10.0.0.19 dev atheros  proto static  scope link  src 10.0.0.12
+batman_route_line = re.compile(
+    rf"\s*{route_address}(?:via\s+{route_address})?dev\s")
+# route -n
+# 10.0.0.27       10.0.0.19       255.255.255.255 UGH   2      0        0 atheros
+olsr_route_line = re.compile(
+    rf"\s*{route_address}{route_address}\d+\.\d+\.\d+\.\d+\s+[A-Z]+\s")
+
+
+def parse_route_line(line):
+    """
+    Parse one line from a route table, as produced by either
+    route-batman or route-olsr in node-utilities.sh
+
+    Returns a tuple dest_id, hop_id
+    Raises ValueError if the line cannot be parsed
+    """
+    match = batman_route_line.match(line) or olsr_route_line.match(line)
+    if not match:
+        raise ValueError(f"unexpected route line {line!r}")
+    dest_id, hop_id = match.groups()
+    # direct route
+    if hop_id is None or hop_id == "0":
+        hop_id = dest_id
+    return int(dest_id), int(hop_id)
+
+
+SampledRoutes = namedtuple('SampledRoutes', ['source', 'sample', 'routes'])
+
+
+class SampledRoutesReader:
+    """
+    Iterate lazily over a ROUTE-TABLE-NN-SAMPLED file as written by
+    route-sample-service.sh, yielding one SampledRoutes per sample,
+    where routes is a dictionary dest_id -> hop_id
+
+    Lines that cannot be parsed are skipped and counted in
+    self.malformed, the rest of the sample is kept
+
+    The sampling service gets killed at the end of the run, so
+    the last sample is most likely incomplete; it is not yielded
+    unless keep_tail is set; self.truncated tells if the file
+    ended in the middle of a line
+    """
+
+    def __init__(self, file_name, source_id, *, keep_tail=False):
+        self.file_name = file_name
+        self.source_id = source_id
+        self.keep_tail = keep_tail
+        self.malformed = 0
+        self.truncated = False
+
+    def __iter__(self):
+        self.malformed = 0
+        self.truncated = False
+        sample_num = -1
+        routes = None
+        with open(self.file_name) as file_routes:
+            for line in file_routes:
+                if not line.endswith("\n"):
+                    self.truncated = True
+                    break
+                if line.startswith("SAMPLE"):
+                    if routes is not None:
+                        yield SampledRoutes(self.source_id, sample_num, routes)
+                    sample_num += 1
+                    routes = {}
+                    continue
+                if not line.strip():
+                    continue
+                try:
+                    if routes is None:
+                        raise ValueError("route line before first sample")
+                    dest_id, hop_id = parse_route_line(line)
+                    routes[dest_id] = hop_id
+                except ValueError:
+                    self.malformed += 1
+        if self.malformed:
+            time_line(f"WARNING: {self.file_name}: "
+                      f"ignored {self.malformed} malformed line(s)")
+        if routes is not None and self.keep_tail:
+            yield SampledRoutes(self.source_id, sample_num, routes)
+
 
 class ProcessRoutes:
     def __init__(self, run_root, exp_nodes, node_ids):
@@ -36,58 +130,33 @@ class ProcessRoutes:
             time_line(f"creating {file_name}")
             with file_name.open() as file_routes:
                 for line in file_routes:
-                    #Batman has another way to display routes
-                    #since we cannot use route -n
-                    line = line.replace("via", "")
-                    dest_ip, hop_ip, *_ = line.split()
-                    if hop_ip == "dev":
-                        hop_ip = dest_ip
-                    dest_id = int(dest_ip.split(".")[-1])
-                    hop_id = int(hop_ip.split(".")[-1])
+                    dest_id, hop_id = parse_route_line(line)
                     self.all_routes[source_id, dest_id] = hop_id
 
         #generate route map file for each selected nodes:
         time_line("Creating files with routes summary - one per exp node")
+        engine = PathEngine(self.next_hop_matrix())
         for exp_node in self.exp_nodes:
             result_name = self.run_root / f"ROUTES-{exp_node:02d}"
-            line_start = "{} --".format(exp_node)
             time_line(f"creating {result_name}")
             with result_name.open("w") as result_file:
                 for dest in self.node_ids:
-                    line_to_write = line_start
-                    src = exp_node
                     if dest != exp_node:
-                        loop_detector = 0
-                        while src != 0 and self.all_routes[src, dest] != dest:
-                            next_hop = self.all_routes[src, dest]
-                            line_to_write += " {} --".format(next_hop)
-                            src = next_hop
-                            loop_detector = loop_detector + 1
-                            if loop_detector > len(self.node_ids):
-                                #time_line(result_name)
-                                #time_line("SAMPLE {}".format(sample))
-                                #time_line(" dest : {}".format( dest))
-                                #time_line("LOOP")
-                                hops = line_to_write.split("--")
-                                hops.remove('')
-                                read_hops = []
-
-                                for hop in hops:
-                                    if int(hop) not in read_hops:
-                                        read_hops.append(int(hop))
-                                    else:
-                                        read_hops.append(int(hop))
-                                        #log_line(read_hops)
-                                        line_to_write = "{} --".format(exp_node)
-                                        read_hops.remove(read_hops[0])
-                                        for i in read_hops:
-                                            line_to_write += " {} --".format(i)
-                                        line_to_write += " {} --".format("-1")
-                                        #log_line(line_to_write)
-                                        break
-                                break
-                        line_to_write += " {}".format(dest)
-                        result_file.write(line_to_write+ "\n")
+                        path = engine.path(exp_node, dest)
+                        result_file.write(
+                            route_line(exp_node, dest, path) + "\n")
+
+    def next_hop_matrix(self):
+        """
+        self.all_routes as a numpy array indexed by node ids
+        """
+        ids = {node for pair in self.all_routes for node in pair}
+        ids.update(self.all_routes.values())
+        size = 1 + max(ids | {37})
+        matrix = np.zeros((size, size), dtype=np.int16)
+        for (source, dest), hop in self.all_routes.items():
+            matrix[source, dest] = hop
+        return matrix
 
 
     def run_sampled(self):
@@ -95,97 +164,85 @@ class ProcessRoutes:
         time_line("Generation global sampled routing map")
         newdir = self.run_root / "SAMPLES"
         newdir.mkdir(parents=True, exist_ok=True)
-        sample_num = -1
-        goto_next_sample = False
-        dict_maps = {0 : self.all_routes.copy()}
+        # node ids are used as indices in the next-hop arrays
+        size = 1 + max(set(self.node_ids) | {37})
+        # source -> list of (sample_num, next-hop row) where the
+        # routing table of that source has changed
+        changes = {}
+        nb_samples = 0
         for source_id in self.node_ids:
             file_name = self.run_root / f"ROUTE-TABLE-{source_id:02d}-SAMPLED"
-            sample_num = -1
             time_line(f"Creating {file_name}")
-            with file_name.open() as file_routes:
-                for line in file_routes:
-                    #time_line(line)
-                    #time_line(file_name)
-                    if "SAMPLE" in line:
-                        if sample_num >= 0:
-                            dict_maps[sample_num] = self.all_routes.copy()
-                        sample_num = sample_num +1
-                        goto_next_sample = False
-                        try:
-                            self.all_routes = dict_maps[sample_num].copy()
-                        except KeyError:
-                            self.reset()
-                            dict_maps[sample_num] = self.all_routes.copy()
-                    else:
-                        #Batman has another way to display routes
-                        #since we cannot use route -n
-                        if not goto_next_sample:
-                            try:
-                                line = line.replace("via", "")
-                                #log_line(sample_num)
-                                #log_line(line)
-                                dest_ip, hop_ip, *_ = line.split()
-                                if hop_ip == "dev":
-                                    hop_ip = dest_ip
-                                dest_id = int(dest_ip.split(".")[-1])
-                                hop_id = int(hop_ip.split(".")[-1])
-                                self.all_routes[source_id, dest_id] = hop_id
-                            except ValueError:
-                                goto_next_sample = True
-                dict_maps[sample_num] = self.all_routes.copy()
-                #log_line(self.all_routes)
-
-        #get sample num and write routing parsed to file sample num -1
+            reader = SampledRoutesReader(file_name, source_id)
+            # as before, the number of samples is the one in the last file
+            changes[source_id], nb_samples = \
+                self._read_sampled_changes(reader, size)
 
+        epochs, next_hops = self._sampled_epochs(changes, nb_samples, size)
 
+        # paths to a destination get computed again only
+        # when the corresponding column has changed
+        cache = {}
+        engines = [PathEngine(matrix, cache=cache) for matrix in next_hops]
         for exp_node in self.exp_nodes:
             result_name = (self.run_root / "SAMPLES"
                            / f"ROUTES-{exp_node:02d}-SAMPLE")
-            line_start = "{} --".format(exp_node)
             time_line(f"Creating {result_name}")
+            blocks = [
+                "".join(route_line(exp_node, dest, engine.path(exp_node, dest))
+                        + "\n"
+                        for dest in self.node_ids if dest != exp_node)
+                for engine in engines
+            ]
             with result_name.open("w") as result_file:
-                for sample in range(0, sample_num):
+                for sample in range(0, nb_samples):
+                    epoch = np.searchsorted(epochs, sample, side='right') - 1
                     result_file.write("SAMPLE {}".format(sample) + "\n")
-                    for dest in self.node_ids:
-                        line_to_write = line_start
-                        src = exp_node
-                        if dest != exp_node:
-                            loop_detector = 0
-                            while src != 0 and dict_maps[sample][src, dest] != dest:
-                                next_hop = dict_maps[sample][src, dest]
-                                #log_line("------------------------------------")
-                                #log_line("Source : {}".format(exp_node))
-                                #time_line"Sample : {}".format(sample))
-                                #time_lineresult_name)
-                                #log_line("src : {} dest : {}".format(src, dest))
-                                #time_line"next hop: {}".format(next_hop))
-                                #time_line"------------------------------------")
-                                line_to_write += " {} --".format(next_hop)
-                                src = next_hop
-                                loop_detector = loop_detector + 1
-                                if loop_detector > len(self.node_ids):
-                                    #log_line(result_name)
-                                    #log_line("SAMPLE {}".format(sample))
-                                    #log_line(" dest : {}".format( dest))
-                                    #log_line("LOOP")
-                                    hops = line_to_write.split("--")
-                                    hops.remove('')
-                                    read_hops = []
-
-                                    for hop in hops:
-                                        if int(hop) not in read_hops:
-                                            read_hops.append(int(hop))
-                                        else:
-                                            read_hops.append(int(hop))
-                                            #log_line(read_hops)
-                                            line_to_write = "{} --".format(exp_node)
-                                            read_hops.remove(read_hops[0])
-                                            for i in read_hops:
-                                                line_to_write += " {} --".format(i)
-                                            line_to_write += " {} --".format("-1")
-                                            #log_line(line_to_write)
-                                            break
-                                    break
-
-                            line_to_write += " {}".format(dest)
-                            result_file.write(line_to_write+ "\n")
+                    result_file.write(blocks[epoch])
+
+    @staticmethod
+    def _read_sampled_changes(reader, size):
+        """
+        Consume a SampledRoutesReader; each sample is turned
+        into a row of next hops indexed by destination, 0 meaning no route
+
+        Returns a tuple changes, nb_samples
+        where changes is a list of (sample_num, row) for the samples
+        where the row differs from the previous sample
+        """
+        changes = []
+        nb_samples = 0
+        for record in reader:
+            row = np.zeros(size, dtype=np.int16)
+            for dest_id, hop_id in record.routes.items():
+                if dest_id < size:
+                    row[dest_id] = hop_id
+            if not changes or not np.array_equal(changes[-1][1], row):
+                changes.append((record.sample, row))
+            nb_samples = record.sample + 1
+        # past the end of the file, the source has no route
+        if changes and changes[-1][1].any():
+            changes.append((nb_samples, np.zeros(size, dtype=np.int16)))
+        return changes, nb_samples
+
+    @staticmethod
+    def _sampled_epochs(changes, nb_samples, size):
+        """
+        Merge the per-source changes into epochs, i.e. the samples
+        where at least one routing table has changed
+
+        Returns a tuple epochs, next_hops where epochs is a sorted array
+        of sample numbers, and next_hops[i] is the (size x size)
+        next-hop matrix that applies from sample epochs[i] onwards
+        """
+        epochs = sorted({sample
+                         for source_changes in changes.values()
+                         for sample, _ in source_changes
+                         if sample < max(nb_samples, 1)})
+        epoch_index = {sample: index for index, sample in enumerate(epochs)}
+        next_hops = np.zeros((len(epochs), size, size), dtype=np.int16)
+        for source_id, source_changes in changes.items():
+            for sample, row in source_changes:
+                if sample in epoch_index:
+                    next_hops[epoch_index[sample]:, source_id] = row
+        return np.array(epochs), next_hops
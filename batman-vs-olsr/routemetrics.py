@@ -0,0 +1,303 @@
+# pylint: disable=c0111, r0902
+"""
+    Route-flap and convergence metrics, computed from the
+    ROUTE-TABLE-NN-SAMPLED files produced by route-sample-service.sh
+
+    All the sampled files of a run are read in lockstep, one sample
+    at a time, so memory only depends on the number of nodes;
+    the result is one ROUTE-METRICS file per run directory,
+    with one line per (source, dest) pair
+"""
+
+import itertools
+from argparse import ArgumentParser
+from collections import Counter, namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from constants import ROUTE_SAMPLE_PERIOD
+from datastore import time_line
+from pathengine import PathEngine
+from processroute import SampledRoutesReader
+
+ROUTE_METRICS = "ROUTE-METRICS"
+
+# the columns in ROUTE-METRICS; all times are in seconds
+#
+# samples: number of samples
+# changes: number of times the path has changed
+# first_route: time of the first sample with a valid route, nan if none
+# longest_stable: longest period with the same valid route
+# loops: number of periods with a routing loop
+# loop_time: total time spent in a loop
+# longest_loop: longest period spent in a loop
+# lengths: number of samples for each length (in hops)
+#          of the valid route, e.g. {1: 12, 2: 30}
+RouteMetric = namedtuple('RouteMetric', [
+    'samples', 'changes', 'first_route', 'longest_stable',
+    'loops', 'loop_time', 'longest_loop', 'lengths'])
+
+
+def is_valid_path(path):
+    return not path.loop and 0 not in path.hops
+
+
+class PairMetrics:
+    """
+    The metrics for one (source, dest) pair,
+    updated with one path per sample
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.changes = 0
+        self.first_route = None
+        self.longest_stable = 0
+        self.loops = 0
+        self.loop_samples = 0
+        self.longest_loop = 0
+        self.lengths = Counter()
+        # the current path and the sample where it started
+        self.path = None
+        self.path_since = 0
+        # the sample where the current loop started
+        self.loop_since = None
+
+    def record(self, path):
+        sample = self.samples
+        previous = self.path
+        if path != previous:
+            if previous is not None:
+                self.changes += 1
+                self._close_path(sample)
+            self.path, self.path_since = path, sample
+        if path.loop:
+            self.loop_samples += 1
+            if self.loop_since is None:
+                self.loops += 1
+                self.loop_since = sample
+        else:
+            self._close_loop(sample)
+            if is_valid_path(path):
+                if self.first_route is None:
+                    self.first_route = sample
+                self.lengths[len(path.hops) + 1] += 1
+        self.samples += 1
+
+    def finish(self):
+        if self.path is not None:
+            self._close_path(self.samples)
+        self._close_loop(self.samples)
+
+    def _close_path(self, sample):
+        if is_valid_path(self.path):
+            self.longest_stable = max(self.longest_stable,
+                                      sample - self.path_since)
+
+    def _close_loop(self, sample):
+        if self.loop_since is not None:
+            self.longest_loop = max(self.longest_loop,
+                                    sample - self.loop_since)
+            self.loop_since = None
+
+    def metric(self, period):
+        return RouteMetric(
+            samples=self.samples,
+            changes=self.changes,
+            first_route=(float('nan') if self.first_route is None
+                         else self.first_route * period),
+            longest_stable=self.longest_stable * period,
+            loops=self.loops,
+            loop_time=self.loop_samples * period,
+            longest_loop=self.longest_loop * period,
+            lengths=dict(sorted(self.lengths.items())),
+        )
+
+
+class RouteMetrics:
+    def __init__(self, run_root, node_ids, *, period=ROUTE_SAMPLE_PERIOD):
+        self.run_root = run_root
+        self.node_ids = node_ids
+        self.period = period
+
+    def _readers(self):
+        readers = []
+        for source_id in self.node_ids:
+            file_name = self.run_root / f"ROUTE-TABLE-{source_id:02d}-SAMPLED"
+            if file_name.exists():
+                readers.append(SampledRoutesReader(file_name, source_id))
+            else:
+                time_line(f"WARNING: missing {file_name}")
+                readers.append(())
+        return readers
+
+    def tails(self):
+        """
+        Returns a dictionary source -> sample, for the sources whose
+        samples from that one on are to be ignored
+
+        Once the routing protocol is killed, the sampling service
+        keeps writing empty tables until it gets killed in its turn;
+        this shows up as a final run of samples without any route -
+        a source whose file has ended has no route either - on most
+        sources at about the same time; in that case, each source's
+        own final run is ignored
+
+        A single source that loses its routes for good is not
+        a teardown, and is kept as is
+        """
+        # source -> number of samples, and first sample of the final
+        # run without any route, for the sources that have had routes
+        lengths, runs = {}, {}
+        for reader in self._readers():
+            for record in reader:
+                lengths[record.source] = record.sample + 1
+                if record.routes:
+                    runs[record.source] = record.sample + 1
+        nb_samples = max(lengths.values(), default=0)
+        tails = {source: sample for source, sample in runs.items()
+                 if sample < nb_samples}
+        if 2 * len(tails) <= len(runs):
+            return {}
+        for source, sample in sorted(tails.items()):
+            time_line(f"{self.run_root}: source {source}:"
+                      f" ignoring {nb_samples - sample} trailing"
+                      f" sample(s) without routes")
+        return tails
+
+    def samples(self, tails=None):
+        """
+        Yields the next-hop matrix for each sample, indexed by node ids
+
+        A source whose file has ended - or is missing - has no route;
+        in the tail of a source, see tails(), its last table is used
+        instead, so that the paths through it remain the same
+        """
+        tails = tails or {}
+        size = 1 + max(set(self.node_ids) | {37})
+        readers = self._readers()
+        last_rows = {}
+        for sample, records in enumerate(itertools.zip_longest(*readers)):
+            matrix = np.zeros((size, size), dtype=np.int16)
+            for source, record in zip(self.node_ids, records):
+                if source in tails and sample >= tails[source]:
+                    matrix[source] = last_rows[source]
+                    continue
+                if record is None:
+                    continue
+                for dest_id, hop_id in record.routes.items():
+                    if dest_id < size:
+                        matrix[record.source, dest_id] = hop_id
+                if source in tails:
+                    last_rows[source] = matrix[source].copy()
+            yield matrix
+
+    def compute(self):
+        """
+        Returns a dictionary (source, dest) -> RouteMetric
+
+        The samples in the tail of a source, see tails(),
+        are not recorded for the pairs from that source
+        """
+        pairs = {
+            (source, dest): PairMetrics()
+            for source in self.node_ids
+            for dest in self.node_ids
+            if source != dest
+        }
+        tails = self.tails()
+        cache = {}
+        for sample, matrix in enumerate(self.samples(tails)):
+            # the cache only saves work on consecutive samples,
+            # no need to keep it growing over long runs
+            if len(cache) > 16 * len(self.node_ids):
+                cache = {}
+            engine = PathEngine(matrix, cache=cache)
+            for (source, dest), metrics in pairs.items():
+                if sample < tails.get(source, sample + 1):
+                    metrics.record(engine.path(source, dest))
+        for metrics in pairs.values():
+            metrics.finish()
+        return {pair: metrics.metric(self.period)
+                for pair, metrics in pairs.items()}
+
+    def run(self):
+        result_name = self.run_root / ROUTE_METRICS
+        time_line(f"Creating {result_name}")
+        metrics = self.compute()
+        with result_name.open("w") as result_file:
+            result_file.write("\t".join(('source', 'dest')
+                                        + RouteMetric._fields) + "\n")
+            for (source, dest), metric in metrics.items():
+                lengths = ",".join(f"{length}:{count}"
+                                   for length, count in metric.lengths.items())
+                fields = (source, dest, *metric[:-1], lengths or "-")
+                result_file.write("\t".join(str(field) for field in fields)
+                                  + "\n")
+
+
+def read_route_metrics(filename):
+    """
+    Read a ROUTE-METRICS file back
+
+    Returns a dictionary (source, dest) -> RouteMetric
+    """
+    metrics = {}
+    with open(filename) as metrics_file:
+        next(metrics_file)
+        for line in metrics_file:
+            source, dest, samples, changes, first_route, longest_stable, \
+                loops, loop_time, longest_loop, lengths = line.split()
+            metrics[int(source), int(dest)] = RouteMetric(
+                samples=int(samples),
+                changes=int(changes),
+                first_route=float(first_route),
+                longest_stable=float(longest_stable),
+                loops=int(loops),
+                loop_time=float(loop_time),
+                longest_loop=float(longest_loop),
+                lengths={int(length): int(count)
+                         for length, count in (
+                             item.split(":") for item in lengths.split(",")
+                             if item != "-")},
+            )
+    return metrics
+
+
+def main():
+    """
+    Computes the metrics of a run directory, without writing them;
+    e.g. on the datasample, where batman has converged from the first
+    sample and the routes between neighbours never change
+
+        python3 routemetrics.py datasample/t1-r54-a1-ch10-INone-batman \\
+            --stable 12-14 --stable 14-12
+
+    Returns 1 if one of the --stable pairs reports any change
+    """
+    parser = ArgumentParser()
+    parser.add_argument("run_root", type=Path)
+    parser.add_argument("--stable", action='append', default=[],
+                        metavar="SOURCE-DEST",
+                        help="check that the route for that pair"
+                        " never changes; can be repeated")
+    args = parser.parse_args()
+    node_ids = sorted(
+        int(file_name.name.split("-")[2])
+        for file_name in args.run_root.glob("ROUTE-TABLE-*-SAMPLED"))
+    metrics = RouteMetrics(args.run_root, node_ids).compute()
+    for (source, dest), metric in metrics.items():
+        print(f"{source}->{dest}: {metric}")
+    unstable = 0
+    for pair in args.stable:
+        source, dest = (int(node_id) for node_id in pair.split("-"))
+        changes = metrics[source, dest].changes
+        if changes:
+            print(f"ERROR: {source}->{dest} reports {changes} change(s)")
+            unstable += 1
+    return 1 if unstable else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -9,13 +9,18 @@ Script to run batman or OLSR routing protocol on R2lab
 # pylint: disable=c0103, r0912, r0913, r0914, r0915
 
 import itertools
+import tarfile
+import gzip
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import shutil
 
 from asynciojobs import Scheduler, Sequence, PrintJob
 
-from apssh import SshNode, SshJob, LocalNode
+from apssh import SshNode, SshJob
 from apssh import Run, RunScript, Pull, Push
 from apssh import TimeColonFormatter
 from apssh import close_ssh_in_scheduler
@@ -23,9 +28,18 @@ from apssh import close_ssh_in_scheduler
 # helpers
 #from processmap import Aggregator
 from processroute import ProcessRoutes
+from routemetrics import RouteMetrics
 from channels import channel_frequency
+from timeline import Timeline, TIMELINE, CHROME_TRACE
+from sshpool import SshPool
+from pcapreader import write_results
 
 from datastore import naming_scheme, apssh_time, time_line
+from datastore import save_run_manifest, ping_header_line
+from checkpoint import (ping_file_complete, load_checkpoint,
+                        save_checkpoint_entry, completed_runs)
+from campaign import (campaign_configs, check_node_sets,
+                      make_node_sets, plan_waves)
 
 from constants import (
     WIRELESS_DRIVER, TX_POWER, PHY_RATE, CHANNEL, ANTENNA_MASK,
@@ -45,6 +59,11 @@ default_protocol = ['batman']
 # once all the nodes have their wireless interface configured
 settle_delay_long = 40
 settle_delay_shorter = 10
+# in adaptive mode, these delays are only upper bounds, and we move on
+# as soon as the routing tables have remained unchanged on all nodes
+# for that many consecutive samples
+settle_stable_samples = 3
+settle_sample_period = 2
 # antenna mask for each node, three values are allowed: 1, 3, 7
 
 all_node_ids = [str(i) for i in range(1, 38)]
@@ -61,6 +80,15 @@ warmup_ping_size = 64
 warmup_ping_interval = 0.5
 warmup_ping_messages = 20
 
+# how to schedule the actual pings
+# sequential: one ping at a time
+# per-source: each source runs its pings one at a time,
+#   but all sources run simultaneously
+# batches: pings are grouped in batches where no node is involved
+#   in 2 pings; batches are run one after the other
+choices_ping_strategy = ['sequential', 'per-source', 'batches']
+default_ping_strategy = 'sequential'
+
 
 # convenience
 def fitname(node_id):
@@ -78,23 +106,230 @@ def purgedir(path):
     shutil.rmtree(path)
 
 
+def extract_ping_archives(run_root):
+    """
+    With batched pings, each source sends back a single
+    PINGS-SS.tar.gz archive; extract the PING files it contains
+    """
+    for archive in sorted(run_root.glob("PINGS-??.tar.gz")):
+        try:
+            with tarfile.open(archive) as tar:
+                tar.extractall(path=run_root)
+        except (OSError, tarfile.TarError) as exc:
+            print(f"Cannot extract {archive} - {exc}")
+
+
+def extract_reduced_captures(run_root):
+    """
+    Unless the full pcap files are requested, each node reduces
+    its capture and sends back a gzipped result-N.txt.gz;
+    decompress them into result-N.txt
+    """
+    for compressed in sorted(run_root.glob("result-*.txt.gz")):
+        try:
+            with gzip.open(compressed) as feed:
+                contents = feed.read()
+            compressed.with_suffix("").write_bytes(contents)
+            compressed.unlink()
+        except (OSError, EOFError) as exc:
+            print(f"Cannot extract {compressed} - {exc}")
+
+
+def parse_pcaps(run_root, node_ids):
+    """
+    With --full-pcap, the raw captures fitN.pcap are retrieved;
+    extract the RSSIs of the pings to each node into result-N.txt,
+    like tshark would on the node
+    """
+    for i in node_ids:
+        pcap = run_root / f"fit{i}.pcap"
+        if not pcap.exists():
+            continue
+        try:
+            write_results(pcap, run_root / f"result-{i}.txt",
+                          dst=f"10.0.0.{i}")
+        except (OSError, ValueError) as exc:
+            print(f"Cannot parse {pcap} - {exc}")
+
+
+def missing_artifacts(run_root, *, ping_pairs, node_ids,
+                      map, route_sampling, tshark, full_pcap, iperf):
+    """
+    Checks the files that a run with these settings is expected
+    to retrieve from the nodes; the ones computed locally
+    afterwards - like ROUTES-NN - are not considered
+
+    Returns a tuple missing_pairs, missing_files where
+    missing_pairs are the pairs with no complete PING file,
+    and missing_files the names of the other files that are
+    not there, or empty - except for the route tables that
+    can legitimately be empty
+    """
+    missing_pairs = [
+        (s, d) for (s, d) in ping_pairs
+        if not ping_file_complete(run_root / f"PING-{s:02d}-{d:02d}",
+                                  header_line=ping_header_line)
+    ]
+    # name -> can be empty
+    expected = {}
+    if map:
+        expected.update((f"ROUTE-TABLE-{id:02d}", True) for id in node_ids)
+    if route_sampling:
+        expected.update((f"ROUTE-TABLE-{id:02d}-SAMPLED", False)
+                        for id in node_ids)
+    if tshark:
+        if full_pcap:
+            expected.update((f"fit{id}.pcap", False) for id in node_ids)
+        # a node that received none of the pings is no useful
+        # result either; and an empty file is what a failed
+        # reduction on the node would most likely leave behind
+        expected.update((f"result-{id}.txt", False) for id in node_ids)
+    if iperf:
+        expected.update((f"IPERF-{s:02d}-{d:02d}", False)
+                        for (s, d) in ping_pairs)
+    missing_files = []
+    for name, can_be_empty in expected.items():
+        path = run_root / name
+        if not path.is_file() or (not can_be_empty
+                                  and path.stat().st_size == 0):
+            missing_files.append(name)
+    return missing_pairs, missing_files
+
+
+def settle_job(message, delay, *, label, adaptive,
+               node_index, protocol, verbose_jobs, **kwds):
+    """
+    Returns a job that lets the wireless network settle
+
+    By default this is a PrintJob that sleeps for delay seconds;
+    in adaptive mode, all nodes poll their routing table, and the job
+    is done as soon as all nodes have stable routes, or after delay
+    seconds at most
+
+    Other keyword arguments, like scheduler or required, are passed along
+    """
+    if not adaptive:
+        return PrintJob(
+            message,
+            sleep=delay,
+            label=f"{label} for {delay} sec",
+            **kwds)
+    wait_jobs = [
+        SshJob(
+            node=node,
+            verbose=verbose_jobs,
+            label=f"wait for stable routes on {id}",
+            command=RunScript("node-utilities.sh", "wait-routes-stable",
+                              protocol, settle_stable_samples,
+                              settle_sample_period, delay,
+                              label="wait for stable routes"))
+        for id, node in node_index.items()
+    ]
+    return Scheduler(
+        *wait_jobs,
+        verbose=verbose_jobs,
+        label=f"{label} until routes are stable, {delay} sec max",
+        **kwds)
+
+
+def load_images_jobs(*, scheduler, gateway, node_ids, scrambler_ids,
+                     required, verbose_jobs):
+    """
+    Adds to scheduler the jobs that load the images on node_ids
+    and the scrambler(s), and turn off all other nodes
+
+    Returns the job that waits for all these nodes to be up
+    """
+    load_ids = list(node_ids) + list(scrambler_ids)
+    # the nodes that we **do not** use should be turned off
+    # so if we have selected e.g. nodes 10 12 and 15, we will do
+    # rhubarbe off -a ~10 ~12 ~15, meaning all nodes except 10, 12 and 15
+    negated_node_ids = [f"~{id}" for id in load_ids]
+
+    # we can do these three things in parallel
+    ready_jobs = [
+        SshJob(node=gateway, required=required,
+               scheduler=scheduler, verbose=verbose_jobs,
+               command=Run("rhubarbe", "off", "-a", *negated_node_ids,
+                           label="turn off unused nodes")),
+        SshJob(node=gateway, required=required,
+               scheduler=scheduler, verbose=verbose_jobs,
+               label="load batman image",
+               command=Run("rhubarbe", "load", "-i",
+                           "batman-olsr",
+                           *node_ids,
+                           label=f"load ubuntu on {node_ids}")),
+        SshJob(
+            node=gateway, required=required,
+            scheduler=scheduler, verbose=verbose_jobs,
+            label="load gnuradio image",
+            command=Run("rhubarbe", "load", "-i",
+                        "batman-olsr-gnuradio",
+                        *scrambler_ids,
+                        label=f"load gnuradio on {scrambler_ids}")),
+    ]
+
+    return SshJob(
+        node=gateway, required=ready_jobs,
+        scheduler=scheduler, verbose=verbose_jobs,
+        label="wait for nodes to come up",
+        command=Run("rhubarbe", "wait", *load_ids))
+
+
+# what prepare_run returns
+# scheduler: the scheduler to run, None in dry-run mode
+# run_root: the directory for results
+# finish: a function to call with the scheduler outcome, once it has run
+RunPlan = namedtuple('RunPlan', ['scheduler', 'run_root', 'finish'])
+
+
+def ping_batches(pairs):
+    """
+    Split a list of (source, destination) pairs into batches
+    so that no node is involved in 2 pings of the same batch
+
+    Returns a list of lists of pairs; this is a greedy first-fit,
+    so pairs are kept in the incoming order within a batch
+    """
+    batches = []
+    busy_nodes = []
+    for pair in pairs:
+        for batch, busy in zip(batches, busy_nodes):
+            if not busy.intersection(pair):
+                batch.append(pair)
+                busy.update(pair)
+                break
+        else:
+            batches.append([pair])
+            busy_nodes.append(set(pair))
+    return batches
+
+
 # using * as the first parameter forces the caller to name all arguments
 # which is a way to avoid stupid mistakes
 # the parameters that don't have a default value
 # still need to be passed of course
-def one_run(*, protocol, interference,
+def prepare_run(*, protocol, interference,
             run_name=default_run_name, slicename=default_slicename,
             tx_power, phy_rate, antenna_mask, channel,
             load_images=False,
             node_ids=DEFAULT_NODE_IDS,
             src_ids=DEFAULT_SRC_IDS, dest_ids=DEFAULT_DEST_IDS,
             scrambler_id=DEFAULT_SCRAMBLER_ID,
-            tshark=False, map=False, warmup=False,
+            tshark=False, full_pcap=False, map=False, warmup=False,
             route_sampling=False, iperf=False,
+            ping_strategy=default_ping_strategy, parallel=None,
+            batch_pings=False, adaptive_settle=False,
             verbose_ssh=False, verbose_jobs=False, dry_run=False,
-            run_number=None):
+            resume=False, pool=None, run_number=None):
     """
-    Performs data acquisition on all nodes with the following settings
+    Prepares data acquisition on all nodes with the following settings
+
+    Returns a RunPlan whose scheduler performs the data acquisition,
+    and whose finish() function must be called once it is over, with
+    the scheduler outcome; returns None if the run cannot proceed.
+    In dry-run mode the plan has no scheduler and nothing to finish,
+    and the same goes when resuming a run that is already complete.
 
     Arguments:
         tx_power: in dBm, a string like 5, 10 or 14.
@@ -113,6 +348,10 @@ def one_run(*, protocol, interference,
         node_ids: a list of node ids to run the scenario against;
           strings or ints are OK;
         tshark: a boolean specifying wether we should format/parse the .pcap.
+          By default each node reduces its own capture into the
+          (source, destination, rssi) triples, and only that is retrieved.
+        full_pcap: with tshark, retrieve the whole pcap files instead,
+          and parse them locally.
         map: a boolean specifying wether we should fetch/parse
           the route tables of the nodes.
         warmup: a boolean specifying whether we should run a ping before
@@ -120,6 +359,23 @@ def one_run(*, protocol, interference,
         src_ids: a list of nodes from which we will launch the ping from.
           strings or ints are OK.
         ping_messages : the number of ping packets that will be generated
+        ping_strategy: how to schedule the pings, one of
+          'sequential', 'per-source' or 'batches'.
+        parallel: with the 'per-source' and 'batches' strategies,
+          the maximal number of simultaneous pings; None or 0 means no limit.
+        batch_pings: if set, each source runs all its pings in a single
+          ssh job, and sends back its PING files in a single archive;
+          cannot be used with the 'batches' strategy.
+        adaptive_settle: if set, instead of sleeping for fixed delays,
+          wait until the routing tables are stable on all nodes,
+          with the fixed delays as upper bounds.
+        resume: if set, and the run directory already has some results,
+          only retrieve what is missing; that is to say, do nothing
+          if the run is complete, and if only some PING files are
+          missing or incomplete, only perform these pings.
+        pool: an SshPool to get the nodes from, so that their ssh
+          connections are shared with other runs; the scheduler must
+          then be run with pool.run()
 
     """
     # set default for the nodes parameter
@@ -137,12 +393,59 @@ def one_run(*, protocol, interference,
     if interference == "None":
         interference = None
 
+    ping_pairs = [
+        (s, d)
+        for s in src_ids
+        # and on the destination
+        for d in dest_ids
+        if d != s
+    ]
+    if ping_strategy == 'batches':
+        if batch_pings:
+            print("batched pings cannot be used with"
+                  " the 'batches' strategy - aborting this run")
+            return None
+        batches = ping_batches(ping_pairs)
+
     # open result dir no matter what
     run_root = naming_scheme(
         run_name=run_name, protocol=protocol,
-        interference=interference, autocreate=True)
+        interference=interference,
+        tx_power=tx_power, phy_rate=phy_rate,
+        antenna_mask=antenna_mask, channel=channel,
+        autocreate=True)
+
+    features = dict(warmup=warmup, tshark=tshark, full_pcap=full_pcap,
+                    map=map,
+                    route_sampling=route_sampling, iperf=iperf,
+                    batch_pings=batch_pings, adaptive_settle=adaptive_settle)
+    # what the run must produce, regardless of what gets resumed
+    expected = dict(ping_pairs=ping_pairs, node_ids=node_ids, map=map,
+                    route_sampling=route_sampling, tshark=tshark,
+                    full_pcap=full_pcap, iperf=iperf)
+
+    resumed_pairs = None
+    if resume:
+        if load_checkpoint(run_name).get(run_root.name, {}).get('complete'):
+            print(f"{run_root} is complete - skipped")
+            return RunPlan(None, run_root, None)
+        missing_pairs, missing_files = missing_artifacts(run_root, **expected)
+        if not missing_pairs and not missing_files:
+            print(f"{run_root} has all its results - skipped")
+            save_checkpoint_entry(run_root, dict(
+                complete=True, missing_pairs=[], missing_files=[],
+                updated=datetime.now().isoformat(timespec='seconds')))
+            return RunPlan(None, run_root, None)
+        if not missing_files:
+            # the other files are there, and the pings that are
+            # missing can be performed on their own
+            resumed_pairs = ping_pairs = missing_pairs
+            tshark = map = route_sampling = iperf = False
+            if ping_strategy == 'batches':
+                batches = ping_batches(ping_pairs)
 
 # fix me    trace = run_root / f"trace-{%m-%d-%H-%M}"
+    started = datetime.now()
     ref_time = apssh_time()
     trace = run_root / f"trace-{ref_time}"
 
@@ -158,10 +461,7 @@ def one_run(*, protocol, interference,
             dests = " ".join(str(n) for n in dest_ids)
             ping_labels = [
                 f"PING {s} ➡︎ {d}"
-                for s in src_ids
-                # and on the destination
-                for d in dest_ids
-                if d != s
+                for (s, d) in ping_pairs
             ]
 
             log_line(f"output in {run_root}")
@@ -176,14 +476,22 @@ def one_run(*, protocol, interference,
             for label in ping_labels:
                 log_line(f"{label}")
             log_line("----")
-            for feature in ('warmup', 'tshark', 'map',
-                            'route_sampling', 'iperf'):
-                log_line(f"Feature {feature}: {locals()[feature]}")
+            log_line(f"Ping strategy: {ping_strategy} - parallel={parallel}")
+            if ping_strategy == 'batches':
+                for index, batch in enumerate(batches, 1):
+                    pairs = " ".join(f"{s}➡︎{d}" for (s, d) in batch)
+                    log_line(f"PING batch {index}/{len(batches)}: {pairs}")
+            log_line("----")
+            for feature, value in features.items():
+                log_line(f"Feature {feature}: {value}")
+            if resumed_pairs:
+                log_line(f"Resuming: only {len(resumed_pairs)} missing"
+                         f" pings, no other feature")
 
     except Exception as exc:
         print(f"Cannot write into {trace} - aborting this run")
         print(f"Found exception {type(exc)} - {exc}")
-        return False
+        return None
     #
     # dry-run mode
     # just display a one-liner with parameters
@@ -194,17 +502,21 @@ def one_run(*, protocol, interference,
         for line in feed:
             print(prelude, line, sep='', end='')
     if dry_run:
-        return True
+        return RunPlan(None, run_root, None)
 
     # the nodes involved
-    faraday = SshNode(hostname=default_gateway, username=slicename,
-                      formatter=TimeColonFormatter(), verbose=verbose_ssh)
+    if pool is not None:
+        faraday = pool.gateway
+    else:
+        faraday = SshNode(hostname=default_gateway, username=slicename,
+                          formatter=TimeColonFormatter(), verbose=verbose_ssh)
 
     # this is a python dictionary that allows to retrieve a node object
     # from an id
     node_index = {
-        id: SshNode(gateway=faraday, hostname=fitname(id), username="root",
-                    formatter=TimeColonFormatter(), verbose=verbose_ssh)
+        id: (pool.node(fitname(id)) if pool is not None else
+             SshNode(gateway=faraday, hostname=fitname(id), username="root",
+                     formatter=TimeColonFormatter(), verbose=verbose_ssh))
         for id in node_ids
     }
     # extracts for sources and destinations
@@ -214,11 +526,14 @@ def one_run(*, protocol, interference,
                   if id in dest_ids}
 
     if interference:
-        node_scrambler = SshNode(
-            gateway=faraday, hostname=fitname(scrambler_id), username="root",
-            formatter=TimeColonFormatter(), verbose=verbose_ssh)
+        node_scrambler = (
+            pool.node(fitname(scrambler_id)) if pool is not None else
+            SshNode(
+                gateway=faraday, hostname=fitname(scrambler_id),
+                username="root",
+                formatter=TimeColonFormatter(), verbose=verbose_ssh))
     # the global scheduler
-    scheduler = Scheduler(verbose=verbose_jobs)
+    scheduler = Scheduler(verbose=verbose_jobs, label=run_root.name)
 
     ##########
     check_lease = SshJob(
@@ -240,43 +555,10 @@ def one_run(*, protocol, interference,
     # then the first call to one_run is with interference being None
     # but it is still important to load the scrambler
     if load_images:
-        # copy node_ids
-        load_ids = node_ids[:]
-        load_ids.append(scrambler_id)
-        # the nodes that we **do not** use should be turned off
-        # so if we have selected e.g. nodes 10 12 and 15, we will do
-        # rhubarbe off -a ~10 ~12 ~15, meaning all nodes except 10, 12 and 15
-        negated_node_ids = [f"~{id}" for id in load_ids]
-
-        # we can do these three things in parallel
-        ready_jobs = [
-            SshJob(node=faraday, required=green_light,
-                   scheduler=scheduler, verbose=verbose_jobs,
-                   command=Run("rhubarbe", "off", "-a", *negated_node_ids,
-                               label="turn off unused nodes")),
-            SshJob(node=faraday, required=green_light,
-                   scheduler=scheduler, verbose=verbose_jobs,
-                   label="load batman image",
-                   command=Run("rhubarbe", "load", "-i",
-                               "batman-olsr",
-                               *node_ids,
-                               label=f"load ubuntu on {node_ids}")),
-            SshJob(
-                node=faraday, required=green_light,
-                scheduler=scheduler, verbose=verbose_jobs,
-                label="load gnuradio image",
-                command=Run("rhubarbe", "load", "-i",
-                            "batman-olsr-gnuradio",
-                            scrambler_id,
-                            label=f"load gnuradio on {scrambler_id}")),
-        ]
-
-        # replace green_light in this case
-        green_light = SshJob(
-            node=faraday, required=ready_jobs,
-            scheduler=scheduler, verbose=verbose_jobs,
-            label="wait for nodes to come up",
-            command=Run("rhubarbe", "wait", *load_ids))
+        green_light = load_images_jobs(
+            scheduler=scheduler, gateway=faraday, node_ids=node_ids,
+            scrambler_ids=[scrambler_id], required=green_light,
+            verbose_jobs=verbose_jobs)
 
     ##########
     # setting up the wireless interface on all nodes
@@ -322,6 +604,25 @@ def one_run(*, protocol, interference,
         verbose=verbose_jobs,
         label="Initialisation of wireless chips")
 
+    # captures are reduced on the nodes at the end of the run;
+    # tshark must come with the image, better find out right away
+    if tshark and not full_pcap:
+        check_tshark_job = [
+            SshJob(
+                node=node,
+                verbose=verbose_jobs,
+                label=f"check tshark on fit node {id}",
+                command=RunScript("node-utilities.sh", "check-tshark", id,
+                                  label="check tshark"),
+            )
+            for id, node in node_index.items()]
+        check_tshark = Scheduler(
+            *check_tshark_job,
+            scheduler=scheduler,
+            required=green_light,
+            verbose=verbose_jobs,
+            label="Check tshark on nodes")
+
     if interference:
         # Run uhd_siggen with the chosen power
         init_scrambler_job = SshJob(
@@ -343,6 +644,8 @@ def one_run(*, protocol, interference,
         )
 
     green_light = [init_wireless_jobs, reset_failed_services]
+    if tshark and not full_pcap:
+        green_light.append(check_tshark)
     # then install and run batman on fit nodes
     run_protocol_job = [
         SshJob(
@@ -431,22 +734,26 @@ def one_run(*, protocol, interference,
             scheduler=settle_scheduler,
             verbose=verbose_jobs,
             label="Warmup pings")
-        settle_wireless_job2 = PrintJob(
+        settle_wireless_job2 = settle_job(
             "Let the wireless network settle after warmup",
-            sleep=settle_delay_shorter,
+            settle_delay_shorter,
+            label="settling-warmup",
+            adaptive=adaptive_settle, node_index=node_index,
+            protocol=protocol, verbose_jobs=verbose_jobs,
             scheduler=settle_scheduler,
-            required=warmup_scheduler,
-            label=f"settling-warmup for {settle_delay_shorter} sec")
+            required=warmup_scheduler)
 
     # this is a little cheating; could have gone before the bloc above
     # but produces a nicer graphical output
     # we might want to help asynciojobs if it offered a means
     # to specify entry and exit jobs in a scheduler
-    settle_wireless_job = PrintJob(
+    settle_wireless_job = settle_job(
         "Let the wireless network settle",
-        sleep=settle_delay_long,
-        scheduler=settle_scheduler,
-        label=f"settling for {settle_delay_long} sec")
+        settle_delay_long,
+        label="settling",
+        adaptive=adaptive_settle, node_index=node_index,
+        protocol=protocol, verbose_jobs=verbose_jobs,
+        scheduler=settle_scheduler)
 
     green_light = settle_scheduler
 
@@ -536,12 +843,14 @@ def one_run(*, protocol, interference,
             required=green_light,
             verbose=verbose_jobs,
             label="Iperf Module")
-        settle_wireless_job_iperf = PrintJob(
+        settle_wireless_job_iperf = settle_job(
             "Let the wireless network settle",
-            sleep=settle_delay_shorter,
+            settle_delay_shorter,
+            label="settling-iperf",
+            adaptive=adaptive_settle, node_index=node_index,
+            protocol=protocol, verbose_jobs=verbose_jobs,
             scheduler=scheduler,
-            required=iperf_sched,
-            label=f"settling-iperf for {settle_delay_shorter} sec")
+            required=iperf_sched)
 
         green_light = settle_wireless_job_iperf
 
@@ -611,9 +920,9 @@ def one_run(*, protocol, interference,
     # to the scheduler, we will add them later on
     # depending on the sequential/parallel strategy
 
-    pings_job = [
-        SshJob(
-            node=node_s,
+    pings_job = {
+        (s, d): SshJob(
+            node=node_index[s],
             verbose=verbose_jobs,
             commands=[
                 Run(f"echo actual ping {s} ➡︎ {d} using {protocol}",
@@ -631,14 +940,13 @@ def one_run(*, protocol, interference,
             ],
         )
         # for each selected experiment nodes
-        for s, node_s in src_index.items()
-        for d, node_d in dest_index.items()
-        if s != d
-    ]
+        for (s, d) in ping_pairs
+    }
     pings = Scheduler(
         scheduler=scheduler,
         label="PINGS",
         verbose=verbose_jobs,
+        jobs_window=parallel,
         required=green_light)
 
     # retrieve all pcap files from fit nodes
@@ -662,7 +970,34 @@ def one_run(*, protocol, interference,
         label="Stop routing protocols",
     )
 
-    if tshark:
+    if tshark and not full_pcap:
+        # the capture is reduced on the node,
+        # and only the gzipped result is retrieved
+        retrieve_tcpdump_job = [
+            SshJob(
+                node=nodei,
+                label=f"reduce pcap trace on fit{i:02d}",
+                verbose=verbose_jobs,
+                commands=[
+                    Run("systemctl stop tcpdump",
+                        label="stop tcpdump"),
+                    RunScript("node-utilities.sh", "reduce-pcap",
+                              f"/tmp/fit{i}.pcap", i,
+                              f"/tmp/result-{i}.txt.gz",
+                              label="reduce pcap"),
+                    Pull(remotepaths=[f"/tmp/result-{i}.txt.gz"],
+                         localpath=str(run_root), label=""),
+                ],
+            )
+            for i, nodei in node_index.items()
+        ]
+        retrieve_tcpdump = Scheduler(
+            *retrieve_tcpdump_job,
+            scheduler=scheduler,
+            required=pings,
+            label="Reduce & retrieve tcpdump",
+        )
+    if tshark and full_pcap:
         retrieve_tcpdump_job = [
             SshJob(
                 # scheduler=scheduler,
@@ -722,35 +1057,6 @@ def one_run(*, protocol, interference,
             verbose=verbose_jobs,
             label="Stop & retrieve route sampling",
             )
-    if tshark:
-        parse_pcaps_job = [
-            SshJob(
-                # scheduler=scheduler,
-                node=LocalNode(),
-                # required=retrieve_tcpdump,
-                label=f"parse pcap trace {run_root}/fit{i}.pcap",
-                verbose=verbose_jobs,
-                #commands = [RunScript("parsepcap.sh", run_root, i)]
-                command=Run("tshark", "-2", "-r",
-                            f"{run_root}/fit{i}.pcap",
-                            "-R",
-                            f"'(ip.dst==10.0.0.{i} && icmp) && radiotap.dbm_antsignal'",
-                            "-Tfields",
-                            "-e", "'ip.src'",
-                            "-e" "'ip.dst'",
-                            "-e", "'radiotap.dbm_antsignal'",
-                            ">", f"{run_root}/result-{i}.txt",
-                            label=f"parsing pcap from {i}"),
-            )
-            for i in node_ids
-        ]
-        parse_pcaps = Scheduler(
-            *parse_pcaps_job,
-            scheduler=scheduler,
-            required=retrieve_tcpdump,
-            label="Parse pcap",
-        )
-
     if interference:
         kill_uhd_siggen = SshJob(
             scheduler=scheduler,
@@ -771,53 +1077,187 @@ def one_run(*, protocol, interference,
             command=Run("rhubarbe", "usrpoff", scrambler_id),
         )
 
-    pings.add(Sequence(*pings_job))
-    # for running sequentially we impose no limit on the scheduler
-    # that will be limitied anyways by the very structure
-    # of the required graph
+    if batch_pings:
+        # in batched mode, one job per source does all the pings
+        # and sends back all the PING files in a single archive
+        batched_pings_job = {
+            s: SshJob(
+                node=node_index[s],
+                verbose=verbose_jobs,
+                commands=[
+                    Run(f"echo actual pings from {s} using {protocol}",
+                        label=f"pings from {s}"),
+                    RunScript("node-utilities.sh", "my-pings", s,
+                              ping_timeout, ping_interval,
+                              ping_size, ping_messages,
+                              f"PINGS-{s:02d}.tar.gz",
+                              *(d for (s2, d) in ping_pairs if s2 == s),
+                              label=""),
+                    Pull(remotepaths=[f"PINGS-{s:02d}.tar.gz"],
+                         localpath=str(run_root),
+                         label=""),
+                ],
+            )
+            for s in src_ids
+            if any(s2 == s for (s2, d) in ping_pairs)
+        }
+        if ping_strategy == 'sequential':
+            pings.add(Sequence(*batched_pings_job.values()))
+        else:
+            pings.update(batched_pings_job.values())
+    elif ping_strategy == 'sequential':
+        pings.add(Sequence(*pings_job.values()))
+        # for running sequentially we impose no limit on the scheduler
+        # that will be limitied anyways by the very structure
+        # of the required graph
+    elif ping_strategy == 'per-source':
+        # one sequence per source, all sources run at the same time
+        for source in src_ids:
+            source_jobs = [job for (s, d), job in pings_job.items()
+                           if s == source]
+            if source_jobs:
+                pings.add(Sequence(*source_jobs))
+    else:
+        # batches run one after the other, the pings in a batch
+        # run simultaneously - within the jobs_window limit
+        batch_schedulers = [
+            Scheduler(
+                *(pings_job[pair] for pair in batch),
+                verbose=verbose_jobs,
+                jobs_window=parallel,
+                label=f"PING batch {index}/{len(batches)}")
+            for index, batch in enumerate(batches, 1)
+        ]
+        pings.add(Sequence(*batch_schedulers))
 
     # safety check
 
     scheduler.export_as_pngfile(run_root / "experiment-graph")
-    if dry_run:
-        scheduler.list()
+
+    def finish(ok):
+        """
+        To be called once the scheduler has run and its ssh
+        connections are closed; returns ok
+        """
+        # even if something went wrong, keep what we could retrieve
+        if batch_pings:
+            extract_ping_archives(run_root)
+        if features['tshark'] and not full_pcap:
+            extract_reduced_captures(run_root)
+        if features['tshark'] and full_pcap:
+            parse_pcaps(run_root, node_ids)
+
+        # give details if it failed
+        if not ok:
+            scheduler.debrief()
+            scheduler.export_as_pngfile("debug")
+        missing_pairs, missing_files = missing_artifacts(run_root, **expected)
+        complete = not missing_pairs and not missing_files
+        # when e.g. some teardown job has failed,
+        # all the data may be there nonetheless
+        if (ok or complete) and features['map']:
+            time_line("Creation of MAP files")
+            post_processor = ProcessRoutes(run_root, src_ids, node_ids)
+            post_processor.run()
+        if (ok or complete) and features['route_sampling']:
+            time_line("Creation of ROUTE SAMPLING files")
+            post_processor = ProcessRoutes(run_root, src_ids, node_ids)
+            post_processor.run_sampled()
+            RouteMetrics(run_root, node_ids).run()
+        # data acquisition is done, let's aggregate results
+        # i.e. compute averages
+        #if ok and tshark:
+            #post_processor = Aggregator(run_root, node_ids, antenna_mask)
+            #post_processor.run()
+
+        ended = datetime.now()
+        save_run_manifest(run_root, dict(
+            run_name=str(run_name),
+            directory=run_root.name,
+            protocol=protocol,
+            interference=str(interference),
+            scrambler_id=scrambler_id,
+            tx_power=int(tx_power),
+            phy_rate=int(phy_rate),
+            antenna_mask=int(antenna_mask),
+            channel=int(channel),
+            node_ids=sorted(node_ids),
+            src_ids=src_ids,
+            dest_ids=dest_ids,
+            features=features,
+            ping_strategy=ping_strategy,
+            parallel=parallel,
+            trace=trace.name,
+            ok=bool(ok),
+            resumed_pairs=resumed_pairs,
+            timings=dict(
+                start=started.isoformat(timespec='seconds'),
+                end=ended.isoformat(timespec='seconds'),
+                duration=round((ended - started).total_seconds(), 1),
+            ),
+            files=sorted(str(path.relative_to(run_root))
+                         for path in run_root.rglob("*") if path.is_file()),
+        ))
+        save_checkpoint_entry(run_root, dict(
+            complete=complete,
+            missing_pairs=missing_pairs,
+            missing_files=missing_files,
+            updated=ended.isoformat(timespec='seconds'),
+        ))
+        if not complete:
+            time_line(f"run incomplete: {len(missing_pairs)} missing pings,"
+                      f" {len(missing_files)} other missing files")
+
+        time_line("one_run done")
+        return ok
+
+    return RunPlan(scheduler, run_root, finish)
+
+
+def one_run(*, dry_run=False, pool=None, **kwds):
+    """
+    Performs data acquisition on all nodes; see prepare_run()
+    for the arguments
+
+    With a pool, the ssh connections are left open for the next runs,
+    otherwise they are closed when the run is over
+
+    Returns True if everything went fine
+    """
+    plan = prepare_run(dry_run=dry_run, pool=pool, **kwds)
+    if plan is None:
+        return False
+    # dry-run, or nothing left to do
+    if plan.scheduler is None:
         return True
 
     # if not in dry-run mode, let's proceed to the actual experiment
-    ok = scheduler.run()  # jobs_window=jobs_window)
-
-    # close all ssh connections
-    close_ssh_in_scheduler(scheduler)
-
-
-    # give details if it failed
-    if not ok:
-        scheduler.debrief()
-        scheduler.export_as_pngfile("debug")
-    if ok and map:
-        time_line("Creation of MAP files")
-        post_processor = ProcessRoutes(run_root, src_ids, node_ids)
-        post_processor.run()
-    if ok and route_sampling:
-        time_line("Creation of ROUTE SAMPLING files")
-        post_processor = ProcessRoutes(run_root, src_ids, node_ids)
-        post_processor.run_sampled()
-    # data acquisition is done, let's aggregate results
-    # i.e. compute averages
-    #if ok and tshark:
-        #post_processor = Aggregator(run_root, node_ids, antenna_mask)
-        #post_processor.run()
-
-    time_line("one_run done")
+    timeline = Timeline(plan.scheduler)
+    if pool is not None:
+        ok = pool.run(plan.scheduler)
+    else:
+        ok = plan.scheduler.run()  # jobs_window=jobs_window)
+        # close all ssh connections
+        close_ssh_in_scheduler(plan.scheduler)
+
+    with timeline.step("post-processing"):
+        ok = plan.finish(ok)
+    timeline.save(plan.run_root / TIMELINE)
+    # next to experiment-graph, what actually happened over time
+    timeline.save_chrome_trace(plan.run_root / CHROME_TRACE)
+    for line in timeline.summary():
+        time_line(line)
     return ok
 
 
 # same as for interference, we force all arguments to be named
 def all_runs(*args, interferences, protocols,
+             tx_powers=None, channels=None, node_sets=None,
              **kwds):
     """
     calls one_run with the cartesian product of
-    protocols, interferences
+    protocols, interferences, tx_powers and channels
+    tx_powers and channels default to the constant settings
 
     All other arguments to one_run may/must be specified as well
 
@@ -826,32 +1266,205 @@ def all_runs(*args, interferences, protocols,
                  interferences=[None, '10'],
                  ...)
         will call one_run exactly 4 times
+
+    If node_sets - a list of lists of node ids - is provided,
+    the runs are performed as a campaign, see run_campaign()
+
+    With resume=True, the runs recorded as complete in the
+    checkpoint are skipped, and the other ones are resumed,
+    see prepare_run()
+
+    All the runs share the same ssh connections, that are
+    closed only once the last run is over
     """
+    if interferences is None:
+        interferences = ["None"]
+    tx_powers = tx_powers or [TX_POWER]
+    channels = channels or [CHANNEL]
+    if node_sets:
+        kwds.pop('node_ids', None)
+        node_sets = make_node_sets(
+            node_sets,
+            src_ids=kwds.pop('src_ids', None) or DEFAULT_SRC_IDS,
+            dest_ids=kwds.pop('dest_ids', None) or DEFAULT_DEST_IDS)
+        return run_campaign(
+            protocols=protocols, interferences=interferences,
+            tx_powers=tx_powers, channels=channels,
+            node_sets=node_sets, **kwds)
+
     # we don't use all() on a list comprehension because
     # (*) we want to run all configs regardless of a failure, and
     #     all() is lazy and would stop at the first failure
     # (*) we need to set load_images to false after the first run
     overall = True
-    if interferences is None:
-        interferences = ["None"]
-    iterator = itertools.product(protocols, interferences)
-    for (run_number, (protocol, interference)) \
-            in enumerate(iterator, 1):
-        if not one_run(
-                protocol=protocol,
-                interference=interference,
-                tx_power=TX_POWER,
-                phy_rate=PHY_RATE,
-                antenna_mask=ANTENNA_MASK,
-                channel=CHANNEL,
-                run_number=run_number,
-                *args, **kwds):
-            overall = False
-        # make sure images will get loaded only once
-        kwds['load_images'] = False
+    completed = (completed_runs(kwds.get('run_name', default_run_name))
+                 if kwds.get('resume') else set())
+    iterator = itertools.product(protocols, interferences,
+                                 tx_powers, channels)
+    with SshPool(default_gateway,
+                 kwds.get('slicename', default_slicename),
+                 verbose=kwds.get('verbose_ssh', False)) as pool:
+        for (run_number, (protocol, interference, tx_power, channel)) \
+                in enumerate(iterator, 1):
+            run_root = naming_scheme(
+                run_name=kwds.get('run_name', default_run_name),
+                protocol=protocol, interference=interference,
+                tx_power=tx_power, phy_rate=PHY_RATE,
+                antenna_mask=ANTENNA_MASK, channel=channel)
+            # checked here so that images get loaded in the first actual run
+            if run_root.name in completed:
+                print(f"{run_root} is complete - skipped")
+                continue
+            if not one_run(
+                    protocol=protocol,
+                    interference=interference,
+                    tx_power=tx_power,
+                    phy_rate=PHY_RATE,
+                    antenna_mask=ANTENNA_MASK,
+                    channel=channel,
+                    run_number=run_number,
+                    pool=pool,
+                    *args, **kwds):
+                overall = False
+            # make sure images will get loaded only once
+            kwds['load_images'] = False
     return overall
 
 
+def run_campaign(*, protocols, interferences, tx_powers, channels,
+                 node_sets,
+                 run_name=default_run_name, slicename=default_slicename,
+                 load_images=False, scrambler_id=DEFAULT_SCRAMBLER_ID,
+                 verbose_ssh=False, verbose_jobs=False, dry_run=False,
+                 resume=False, **kwds):
+    """
+    Performs the cartesian product of protocols, interferences,
+    tx_powers and channels, over node_sets - a list of campaign.NodeSet
+    that must be disjoint
+
+    Runs are grouped in waves as per campaign.plan_waves(); the runs
+    in a wave take place at the same time, on separate node sets and
+    non-overlapping channels; waves are performed one after the other.
+    Everything is run by a single scheduler, so in a single event loop,
+    and if requested, images are loaded once on all the nodes involved.
+
+    With resume=True, the configs recorded as complete in the
+    checkpoint are left out before waves are planned
+
+    Other arguments are passed to prepare_run()
+
+    Returns True if all runs went fine
+    """
+    try:
+        check_node_sets(node_sets, int(scrambler_id))
+    except ValueError as exc:
+        print(f"Cannot run campaign - {exc}")
+        return False
+    configs = campaign_configs(
+        protocols=protocols, interferences=interferences,
+        tx_powers=tx_powers, channels=channels)
+    if resume:
+        completed = completed_runs(run_name)
+        pending = [
+            config for config in configs
+            if naming_scheme(
+                run_name=run_name, protocol=config.protocol,
+                interference=config.interference,
+                tx_power=config.tx_power, phy_rate=PHY_RATE,
+                antenna_mask=ANTENNA_MASK,
+                channel=config.channel).name not in completed]
+        print(f"resuming campaign: {len(configs) - len(pending)}"
+              f" complete runs skipped")
+        configs = pending
+    waves = plan_waves(configs, node_sets)
+
+    print(f"**************** campaign: {len(configs)} runs"
+          f" in {len(waves)} waves")
+    for index, wave in enumerate(waves, 1):
+        contents = " | ".join(
+            f"{config.protocol} I{config.interference}"
+            f" t{config.tx_power} ch{config.channel}"
+            f" on {' '.join(str(id) for id in node_set.node_ids)}"
+            for config, node_set in wave)
+        print(f"wave {index}/{len(waves)}: {contents}")
+
+    campaign = Scheduler(verbose=verbose_jobs, label="campaign")
+    # all the runs share the same ssh connections, that get closed
+    # when the campaign is over, or if anything goes wrong
+    with SshPool(default_gateway, slicename, verbose=verbose_ssh) as pool:
+        green_light = None
+        if load_images:
+            green_light = load_images_jobs(
+                scheduler=campaign, gateway=pool.gateway,
+                node_ids=sorted(id for node_set in node_sets
+                                for id in node_set.node_ids),
+                scrambler_ids=[scrambler_id], required=None,
+                verbose_jobs=verbose_jobs)
+
+        overall = True
+        plans = []
+        wave_schedulers = []
+        run_number = 0
+        for index, wave in enumerate(waves, 1):
+            wave_plans = []
+            for config, node_set in wave:
+                run_number += 1
+                plan = prepare_run(
+                    protocol=config.protocol,
+                    interference=config.interference,
+                    tx_power=config.tx_power,
+                    phy_rate=PHY_RATE,
+                    antenna_mask=ANTENNA_MASK,
+                    channel=config.channel,
+                    node_ids=node_set.node_ids,
+                    src_ids=node_set.src_ids,
+                    dest_ids=node_set.dest_ids,
+                    run_name=run_name,
+                    slicename=slicename,
+                    load_images=False,
+                    scrambler_id=scrambler_id,
+                    verbose_ssh=verbose_ssh,
+                    verbose_jobs=verbose_jobs,
+                    dry_run=dry_run,
+                    resume=resume,
+                    pool=pool,
+                    run_number=run_number,
+                    **kwds)
+                if plan is None:
+                    overall = False
+                elif plan.scheduler is not None:
+                    # a failing run must not abort the other ones
+                    plan.scheduler.critical = False
+                    wave_plans.append(plan)
+            plans.extend(wave_plans)
+            if wave_plans:
+                wave_schedulers.append(Scheduler(
+                    *(plan.scheduler for plan in wave_plans),
+                    critical=False,
+                    verbose=verbose_jobs,
+                    label=f"wave {index}/{len(waves)}"))
+        if dry_run or not wave_schedulers:
+            return overall
+
+        Sequence(*wave_schedulers, required=green_light, scheduler=campaign)
+        timeline = Timeline(campaign)
+        ok = pool.run(campaign)
+
+    for plan in plans:
+        # runs do not even start if e.g. image loading fails
+        run_ok = (plan.scheduler.is_done()
+                  and not plan.scheduler.raised_exception()
+                  and plan.scheduler.result() is True)
+        with timeline.step(f"post-processing {plan.run_root.name}"):
+            if not plan.finish(run_ok):
+                overall = False
+    timeline.save(Path(run_name) / TIMELINE)
+    timeline.save_chrome_trace(Path(run_name) / CHROME_TRACE)
+    for line in timeline.summary():
+        time_line(line)
+    return ok and overall
+
+
 def main():
     """
     Command-line frontend - offers primarily all options to all_runs
@@ -896,6 +1509,16 @@ def main():
         "-I", "--all-interferences", default=False, action='store_true',
         help=f"Use all values of interference in {CHOICES_INTERFERENCE}")
 
+    parser.add_argument(
+        "--tx-power", dest='tx_power', metavar='tx-power',
+        default=[TX_POWER], type=int, nargs='+',
+        help="the transmission power(s), in dBm")
+    parser.add_argument(
+        "--channel", dest='channel', metavar='channel',
+        default=[CHANNEL], type=int, nargs='+',
+        choices=list(channel_frequency.keys()),
+        help="the wifi channel(s)")
+
     parser.add_argument(
         "-N", "--node", dest='node_ids', metavar='routing-node',
         default=DEFAULT_NODE_IDS, choices=all_node_ids,
@@ -922,6 +1545,14 @@ def main():
         "--all-destinations", dest='all_dest', default=False, action='store_true',
         help="if set, all nodes in the experiment are used as destinations"
     )
+    parser.add_argument(
+        "--node-set", dest='node_sets', metavar='node',
+        default=None, choices=all_node_ids, nargs='+', action='append',
+        help="run as a campaign over disjoint sets of nodes; repeat to"
+             " define several sets, in which case runs on different sets"
+             " and non-overlapping channels take place at the same time;"
+             " the sources and destinations in a set are the ones given"
+             " with -S and -D, or all its nodes if none is in the set")
     parser.add_argument(
         "--scrambler", dest='scrambler_id', metavar='scrambler-node',
         default=DEFAULT_SCRAMBLER_ID, choices=CHOICES_SCRAMBLER_ID,
@@ -943,8 +1574,12 @@ def main():
         help="observe and recolt the routing table over time during the experiment")
     parser.add_argument(
         "--tshark", default=False, action='store_true',
-        help="parse pcap files to get RSSIs for each nodes"
-             " (Warning: you need to have tshark installed on your machine)")
+        help="capture traffic to get RSSIs for each nodes; each node"
+             " reduces its capture, and only the result is retrieved")
+    parser.add_argument(
+        "--full-pcap", default=False, action='store_true',
+        help="with --tshark, retrieve the whole pcap files and parse them"
+             " locally")
     parser.add_argument(
         "--all-extras", default=False, action='store_true',
         help="enable 4 extra features: warmup, iperf, "
@@ -953,6 +1588,33 @@ def main():
              " and thus performs MUCH more slowly."
     )
 
+    parser.add_argument(
+        "--ping-strategy", default=default_ping_strategy,
+        choices=choices_ping_strategy,
+        help="sequential runs one ping at a time;"
+             " per-source runs one ping per source at a time;"
+             " batches runs at the same time pings that involve"
+             " disjoint nodes - batches are logged in the trace file")
+    parser.add_argument(
+        "--adaptive-settle", default=False, action='store_true',
+        help=f"instead of sleeping for {settle_delay_long}s (or"
+             f" {settle_delay_shorter}s), move on as soon as the routing"
+             f" tables are stable on all nodes")
+    parser.add_argument(
+        "--batch-pings", default=False, action='store_true',
+        help="run all the pings of a source in a single ssh session,"
+             " and retrieve its PING files as a single archive")
+    parser.add_argument(
+        "--parallel", default=None, type=int,
+        help="with per-source or batches, a limit to the number"
+             " of simultaneous pings - 0 means no limit")
+
+    parser.add_argument(
+        "--resume", default=False, action='store_true',
+        help="skip the runs recorded as complete in the output directory,"
+             " and in a partially complete run, only perform the"
+             " missing pings")
+
     parser.add_argument(
         "-n", "--dry-run", default=False, action='store_true',
         help="do not run anything, just print out scheduler,"
@@ -983,6 +1645,9 @@ def main():
     return all_runs(
         protocols=args.protocol,
         interferences=args.interference,
+        tx_powers=args.tx_power,
+        channels=args.channel,
+        node_sets=args.node_sets,
         run_name=args.run_name,
         slicename=args.slicename,
         load_images=args.load_images,
@@ -992,14 +1657,21 @@ def main():
         scrambler_id=args.scrambler_id,
 
         tshark=args.tshark,
+        full_pcap=args.full_pcap,
         map=args.map,
         warmup=args.warmup,
         route_sampling=args.route_sampling,
         iperf=args.iperf,
 
+        ping_strategy=args.ping_strategy,
+        parallel=args.parallel,
+        batch_pings=args.batch_pings,
+        adaptive_settle=args.adaptive_settle,
+
         verbose_ssh=args.verbose_ssh,
         verbose_jobs=args.debug,
         dry_run=args.dry_run,
+        resume=args.resume,
     )
 
 
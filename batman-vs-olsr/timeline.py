@@ -0,0 +1,424 @@
+# pylint: disable=c0111, w0212
+"""
+    Timing instrumentation for asynciojobs schedulers
+
+    A Timeline is attached to a scheduler before it runs; it records
+    when each job - including nested schedulers - and each command
+    in an SshJob starts and ends, how long it takes to establish
+    each ssh connection, and how much data each Pull retrieves
+
+    Once the scheduler is done, the timeline can be saved as JSON,
+    and summarized along its critical path, i.e. the chain of jobs
+    that, each waiting for the previous one, have determined the
+    overall duration
+
+    It can also be exported in the Chrome Trace Event format, with
+    one lane per node, so it can be browsed in chrome://tracing or
+    https://ui.perfetto.dev
+
+    This module is copied as is in the demos that use it
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+
+from asynciojobs import Scheduler
+from apssh import SshJob, LocalNode, Pull
+
+TIMELINE = "timeline.json"
+CHROME_TRACE = "experiment-trace.json"
+
+
+def _job_label(job):
+    return job.label or job.text_label() or type(job).__name__
+
+
+def _command_label(command):
+    # runs.py uses empty labels to keep its graphs readable
+    return command.label or command.label_line() or type(command).__name__
+
+
+def node_name(node):
+    if node is None:
+        return None
+    if isinstance(node, LocalNode):
+        return "localhost"
+    return node.hostname
+
+
+def _pulled_bytes(pull):
+    paths = pull.remotepaths
+    if isinstance(paths, str):
+        paths = [paths]
+    total = 0
+    for path in paths:
+        local = Path(pull.localpath) / PurePosixPath(path).name
+        if local.is_file():
+            total += local.stat().st_size
+    return total
+
+
+class Timeline:
+    """
+    Instruments scheduler and all the jobs it contains, so create
+    it once the scheduler is complete and before it is run
+
+    Times are wall-clock, in seconds since epoch
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        # job -> record; a record is a dict with
+        # start, end, and for SshJobs a list of commands
+        self.jobs = {}
+        # job -> the scheduler that it belongs in
+        self.parents = {}
+        # one entry per connection attempt
+        self.connections = []
+        # local steps, like post-processing, see step()
+        self.steps = []
+        self._instrument(scheduler, None)
+
+    def _instrument(self, job, parent):
+        record = self.jobs[job] = dict(start=None, end=None)
+        self.parents[job] = parent
+        self._wrap(job, 'co_run', record)
+        if isinstance(job, Scheduler):
+            for sub in job.jobs:
+                self._instrument(sub, job)
+        elif isinstance(job, SshJob):
+            record['commands'] = []
+            for command in job.commands:
+                command_record = dict(label=_command_label(command),
+                                      start=None, end=None)
+                record['commands'].append(command_record)
+                method = ('co_run_local' if isinstance(job.node, LocalNode)
+                          else 'co_run_remote')
+                self._wrap(command, method, command_record)
+            node = job.node
+            while node is not None and not isinstance(node, LocalNode):
+                self._instrument_node(node)
+                node = node.gateway
+
+    def _instrument_node(self, node):
+        # a node is typically shared by many jobs
+        if getattr(node, '_timeline', None) is self:
+            return
+        node._timeline = self
+        for method, kind in (('_connect', 'ssh'), ('_sftp_connect', 'sftp')):
+            record = dict(node=node_name(node), kind=kind)
+            self._wrap(node, method, record, self.connections)
+
+    @staticmethod
+    def _wrap(instance, method, record, records=None):
+        """
+        Replaces instance.method - a coroutine - with a version that
+        stores its start and end times in record; if records is set,
+        a copy of record is appended to it on each call instead
+
+        Nodes from an SshPool get instrumented by several timelines
+        in a row, so we always wrap the original method
+        """
+        originals = instance.__dict__.setdefault('_untimed', {})
+        original = originals.setdefault(method, getattr(instance, method))
+
+        async def timed(*args, **kwds):
+            current = record if records is None else dict(record)
+            if records is not None:
+                records.append(current)
+            current['start'] = time.time()
+            try:
+                return await original(*args, **kwds)
+            finally:
+                current['end'] = time.time()
+                if isinstance(instance, Pull):
+                    current['bytes'] = _pulled_bytes(instance)
+
+        setattr(instance, method, timed)
+
+    @contextmanager
+    def step(self, label):
+        """
+        Records a local step that runs outside of the scheduler, e.g.
+
+            with timeline.step("post-processing"):
+                ...
+        """
+        record = dict(label=label, start=time.time(), end=None)
+        self.steps.append(record)
+        try:
+            yield record
+        finally:
+            record['end'] = time.time()
+
+    ##########
+    def _ran(self, job):
+        record = self.jobs.get(job)
+        return record is not None and record['end'] is not None
+
+    def _last_ended(self, jobs):
+        candidates = [job for job in jobs
+                      if self._ran(job) and not job.forever]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda job: self.jobs[job]['end'])
+
+    def critical_path(self):
+        """
+        The list of (non-scheduler) jobs that make up the critical path,
+        in chronological order
+
+        Starting from the job that ended last, we go backwards to
+        the requirement that ended last - i.e. the one that was
+        waited for - and so on; a job with no requirement in a nested
+        scheduler was waiting for that scheduler to start, and a
+        required scheduler was waited for through its last job
+        """
+        path = []
+        job = self._last_ended(self.scheduler.jobs)
+        while job is not None:
+            if isinstance(job, Scheduler):
+                inner = self._last_ended(job.jobs)
+                if inner is not None:
+                    job = inner
+                    continue
+            else:
+                path.append(job)
+            # go up until some requirement is found
+            current = job
+            job = None
+            while current is not None and current is not self.scheduler:
+                job = self._last_ended(current.required)
+                if job is not None:
+                    break
+                current = self.parents[current]
+        path.reverse()
+        return path
+
+    def origin(self):
+        starts = [record['start']
+                  for record in (*self.jobs.values(), *self.steps)
+                  if record['start'] is not None]
+        return min(starts) if starts else time.time()
+
+    def as_dict(self):
+        """
+        A JSON-friendly view; times are relative to the origin,
+        i.e. the start of the first job, and rounded to the ms
+        """
+        origin = self.origin()
+
+        def relative(record):
+            result = dict(record)
+            for key in ('start', 'end'):
+                if result.get(key) is not None:
+                    result[key] = round(result[key] - origin, 3)
+            return result
+
+        ids = {job: index for index, job in enumerate(self.jobs)}
+        critical = set(self.critical_path())
+        jobs = []
+        for job, record in self.jobs.items():
+            entry = relative(record)
+            entry.update(
+                id=ids[job],
+                label=_job_label(job),
+                scheduler=isinstance(job, Scheduler),
+                node=node_name(getattr(job, 'node', None)),
+                parent=ids.get(self.parents[job]),
+                required=sorted(ids[req] for req in job.required
+                                if req in ids),
+                forever=bool(job.forever),
+                critical=job in critical,
+            )
+            if 'commands' in record:
+                entry['commands'] = [relative(command)
+                                     for command in record['commands']]
+            jobs.append(entry)
+        return dict(
+            origin=origin,
+            jobs=jobs,
+            connections=[relative(record) for record in self.connections],
+            steps=[relative(record) for record in self.steps],
+            critical_path=[ids[job] for job in self.critical_path()],
+        )
+
+    def save(self, filename):
+        with Path(filename).open('w') as feed:
+            json.dump(self.as_dict(), feed, indent=1)
+            feed.write("\n")
+
+    def save_chrome_trace(self, filename):
+        with Path(filename).open('w') as feed:
+            json.dump(chrome_trace(self.as_dict()), feed)
+            feed.write("\n")
+
+    def summary(self):
+        """
+        A list of lines that describe the critical path,
+        the ssh connections and the Pull transfers
+        """
+        origin = self.origin()
+        lines = []
+        path = self.critical_path()
+        if path:
+            total = self.jobs[path[-1]]['end'] - origin
+            lines.append(f"critical path: {len(path)} jobs, {total:.1f}s")
+        for job in path:
+            record = self.jobs[job]
+            duration = record['end'] - record['start']
+            node = node_name(getattr(job, 'node', None)) or "-"
+            lines.append(f"  at {record['start'] - origin:7.1f}s"
+                         f" {duration:7.1f}s {node:>10} {_job_label(job)}")
+            # the details of the commands that took more than a second
+            for command in record.get('commands', []):
+                if command['end'] is None:
+                    continue
+                duration = command['end'] - command['start']
+                if duration >= 1:
+                    lines.append(f"  {'':>17}{duration:7.1f}s"
+                                 f" {'':>10}   {command['label']}")
+        for step in self.steps:
+            if step['end'] is not None:
+                lines.append(f"step {step['label']}:"
+                             f" {step['end'] - step['start']:.1f}s")
+        connects = [record['end'] - record['start']
+                    for record in self.connections
+                    if record.get('end') is not None]
+        if connects:
+            lines.append(f"{len(connects)} connections:"
+                         f" {sum(connects):.1f}s in total,"
+                         f" {max(connects):.1f}s max")
+        pulls = [command for record in self.jobs.values()
+                 for command in record.get('commands', [])
+                 if 'bytes' in command]
+        if pulls:
+            size = sum(command['bytes'] for command in pulls)
+            duration = sum(command['end'] - command['start']
+                           for command in pulls)
+            lines.append(f"{len(pulls)} pulls: {size} bytes"
+                         f" in {duration:.1f}s")
+        return lines
+
+    def print_summary(self):
+        for line in self.summary():
+            print(line)
+
+
+##########
+# in the trace, nested schedulers go in lanes of their own,
+# and local steps in the localhost lane
+SCHEDULERS_LANE = "schedulers"
+LOCAL_LANE = "localhost"
+
+
+def _microseconds(seconds):
+    return int(round(seconds * 1_000_000))
+
+
+def chrome_trace(timeline):
+    """
+    Converts a timeline - as returned by Timeline.as_dict(),
+    or read back from a timeline.json - into a Chrome Trace Event
+    dictionary, where each job is a complete event
+
+    Each node - the gateway, the fit nodes, and localhost - has its own
+    lane, with its jobs and their commands nested inside; when jobs
+    overlap on a node, like a forever job running alongside others,
+    additional lanes like 'fit01 #2' are created. The ssh connections
+    are shown in the lane of the job that triggered them
+    """
+    events = []
+    # lane name -> (thread id, stack of the (start, end) still open)
+    lanes = {}
+
+    def allocate(node, start, end, nest=False):
+        # with nest=True, an event can go inside one that contains it
+        index = 1
+        while True:
+            name = node if index == 1 else f"{node} #{index}"
+            if name not in lanes:
+                lanes[name] = (len(lanes) + 1, [(start, end)])
+                return name
+            stack = lanes[name][1]
+            while stack and stack[-1][1] <= start:
+                stack.pop()
+            if not stack or (nest and end <= stack[-1][1]):
+                stack.append((start, end))
+                return name
+            index += 1
+
+    def complete(name, category, start, end, lane, args=None):
+        event = dict(name=name, cat=category, ph='X', pid=1,
+                     tid=lanes[lane][0], ts=_microseconds(start),
+                     dur=_microseconds(max(end - start, 0)))
+        if args:
+            event['args'] = args
+        events.append(event)
+
+    ends = [record['end'] for record in timeline['jobs']
+            if record['end'] is not None]
+    horizon = max(ends, default=0)
+    # lane name, start, end for each job on a node
+    node_jobs = {}
+    started = sorted((job for job in timeline['jobs']
+                      if job['start'] is not None),
+                     key=lambda job: job['start'])
+    for job in started:
+        # a job that did not complete is shown up to the last event
+        end = job['end'] if job['end'] is not None else horizon
+        node = (SCHEDULERS_LANE if job['scheduler']
+                else job['node'] or LOCAL_LANE)
+        lane = allocate(node, job['start'], end, nest=job['scheduler'])
+        node_jobs.setdefault(node, []).append((lane, job['start'], end))
+        args = dict(id=job['id'], required=job['required'])
+        for key in ('critical', 'forever'):
+            if job[key]:
+                args[key] = True
+        category = "critical" if job['critical'] else (
+            "scheduler" if job['scheduler'] else "job")
+        complete(job['label'], category, job['start'], end, lane, args)
+        for command in job.get('commands', []):
+            if command['start'] is None:
+                continue
+            command_end = (command['end'] if command['end'] is not None
+                           else end)
+            args = ({'bytes': command['bytes']}
+                    if 'bytes' in command else None)
+            complete(command['label'], "command",
+                     command['start'], command_end, lane, args)
+    for connection in timeline['connections']:
+        if connection.get('end') is None:
+            continue
+        node = connection['node']
+        lane = next(
+            (lane for lane, start, end in node_jobs.get(node, [])
+             if start <= connection['start'] <= end),
+            None)
+        if lane is None:
+            lane = allocate(node, connection['start'], connection['end'])
+        complete(f"{connection['kind']} connect", "connection",
+                 connection['start'], connection['end'], lane)
+    for step in timeline['steps']:
+        if step['end'] is None:
+            continue
+        lane = allocate(LOCAL_LANE, step['start'], step['end'])
+        complete(step['label'], "step", step['start'], step['end'], lane)
+
+    # name the lanes, and show them in a sensible order
+    def sort_key(name):
+        node = name.split(" #")[0]
+        return (node != SCHEDULERS_LANE, node == LOCAL_LANE, name)
+    metadata = [dict(name='process_name', ph='M', pid=1,
+                     args=dict(name="experiment"))]
+    for index, name in enumerate(sorted(lanes, key=sort_key)):
+        tid = lanes[name][0]
+        metadata.append(dict(name='thread_name', ph='M', pid=1, tid=tid,
+                             args=dict(name=name)))
+        metadata.append(dict(name='thread_sort_index', ph='M', pid=1,
+                             tid=tid, args=dict(sort_index=index)))
+    return dict(traceEvents=metadata + events, displayTimeUnit='ms',
+                otherData=dict(origin=timeline['origin']))
+
@@ -26,6 +26,8 @@ from r2lab import r2lab_hostname, r2lab_parse_slice, find_local_embedded_script
 # argument parsing
 from r2lab import ListOfChoices, ListOfChoicesNullReset
 
+from timeline import Timeline
+
 
 # include the set of utility scripts that are included by the r2lab kit
 INCLUDES = [find_local_embedded_script(x) for x in (
@@ -88,7 +90,7 @@ def run(*,                                # pylint: disable=r0912, r0914, r0915
         # the images to load
         image_cn, image_ran, image_oai_ue, image_e3372_ue, image_gnuradio,
         # miscell
-        n_rb, verbose, dry_run):
+        n_rb, save_timeline, verbose, dry_run):
     """
     ##########
     # 3 methods to get nodes ready
@@ -113,6 +115,8 @@ def run(*,                                # pylint: disable=r0912, r0914, r0915
                   image_cn, image_ran and image_*
                   are used to tell the image names
     * reset_usb : the USRP board will be reset when this is set
+    * save_timeline : the timing of the run is saved in <name>-timeline.json
+                      and <name>-trace.json, see timeline.py
     """
 
     # what argparse knows as a slice actually is about the gateway (user + host)
@@ -321,7 +325,14 @@ def run(*,                                # pylint: disable=r0912, r0914, r0915
     if verbose:
         input('OK ? - press control C to abort ? ')
 
-    if not scheduler.orchestrate():
+    timeline = Timeline(scheduler)
+    ok = scheduler.orchestrate()
+    timeline.print_summary()
+    if save_timeline:
+        timeline.save(f"{name}-timeline.json")
+        timeline.save_chrome_trace(f"{name}-trace.json")
+        print(f"(Over)wrote {name}-timeline.json and {name}-trace.json")
+    if not ok:
         print(f"RUN KO : {scheduler.why()}")
         scheduler.debrief()
         return False
@@ -510,6 +521,12 @@ that shows the nodes that currently embed the
 capabilities to run as either E3372- and
 OpenAirInterface-based UE. Does nothing else.""")
 
+    parser.add_argument(
+        "-t", "--timeline", dest='save_timeline',
+        action='store_true', default=False,
+        help="""save the timing of the run in mosaic-timeline.json,
+and as a Chrome trace in mosaic-trace.json""")
+
     parser.add_argument(
         "-v", "--verbose", action='store_true', default=False)
     parser.add_argument(
@@ -18,6 +18,8 @@ from r2lab import r2lab_hostname, r2lab_parse_slice, find_local_embedded_script
 # argument parsing
 from r2lab import ListOfChoices, ListOfChoicesNullReset
 
+from timeline import Timeline
+
 
 # include the set of utility scripts that are included by the r2lab kit
 includes = [ find_local_embedded_script(x) for x in [
@@ -80,7 +82,7 @@ def run(*,
         # the images to load
         image_gw, image_enb, image_oai_ue, image_e3372_ue, image_gnuradio,
         # miscell
-        n_rb, verbose, dry_run):
+        n_rb, save_timeline, verbose, dry_run):
     """
     ##########
     # 3 methods to get nodes ready
@@ -106,6 +108,8 @@ def run(*,
                   image_gw, image_enb and image_*
                   are used to tell the image names
     * skip_reset_usb : the USRP board will be reset as well unless this is set
+    * save_timeline : the timing of the run is saved in scenario-timeline.json
+                      and scenario-trace.json, see timeline.py
     """
 
     # what argparse knows as a slice actually is a gateway (user + host)
@@ -366,7 +370,14 @@ def run(*,
     if verbose:
         input('OK ? - press control C to abort ? ')
 
-    if not sched.orchestrate():
+    timeline = Timeline(sched)
+    ok = sched.orchestrate()
+    timeline.print_summary()
+    if save_timeline:
+        timeline.save("scenario-timeline.json")
+        timeline.save_chrome_trace("scenario-trace.json")
+        print("(Over)wrote scenario-timeline.json and scenario-trace.json")
+    if not ok:
         print("RUN KO : {}".format(sched.why()))
         sched.debrief()
         return False
@@ -546,6 +557,11 @@ that shows the nodes that currently embed the
 capabilities to run as either E3372- and
 OpenAirInterface-based UE. Does nothing else.""")
 
+    parser.add_argument("-t", "--timeline", dest='save_timeline',
+                        action='store_true', default=False,
+                        help="save the timing of the run in scenario-timeline.json,"
+                        " and as a Chrome trace in scenario-trace.json")
+
     parser.add_argument("-v", "--verbose", action='store_true', default=False)
     parser.add_argument("-n", "--dry-run", action='store_true', default=False)
 
@@ -8,9 +8,10 @@ See visumap.ipynb for how to use it
 # pylint: disable=c0111, c0103, c0326, r0913, r0914
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import datetime
 from pathlib import Path
 
-from asynciojobs import Scheduler, Sequence, PrintJob
+from asynciojobs import Scheduler, Sequence, PrintJob, AbstractJob
 
 from apssh import SshNode, SshJob
 from apssh import Run, RunScript, Pull
@@ -20,8 +21,12 @@ from apssh import TimeColonFormatter
 from r2lab import ListOfChoices
 
 # helpers
-from processmap import Aggregator
+from processmap import Aggregator, aggregation_complete
 from channels import channel_frequency
+from timeline import Timeline, TIMELINE, CHROME_TRACE
+from sshpool import SshPool
+from checkpoint import (ping_file_complete, load_checkpoint,
+                        save_checkpoint_entry, completed_runs)
 
 ##########
 default_gateway      = 'faraday.inria.fr'
@@ -87,12 +92,76 @@ def naming_scheme(run_name, tx_power, phy_rate, antenna_mask, channel,
     return run_root
 
 
+##########
+# a checkpoint.json in the run_name directory records the run
+# directories whose results are complete, so that a resumed
+# campaign can skip them; see checkpoint.py
+
+def record_complete(run_root):
+    """
+    Records run_root as complete in the checkpoint
+    """
+    save_checkpoint_entry(run_root, dict(
+        complete=True, missing_files=[],
+        updated=datetime.now().isoformat(timespec='seconds')))
+
+
+def missing_results(run_root, node_ids):
+    """
+    Returns the names of the files that a complete run
+    on these nodes has produced, but that are missing
+    or incomplete in run_root
+    """
+    missing = [
+        "PING-{:02d}-{:02d}".format(i, j)
+        for i in node_ids for j in node_ids if j > i
+        if not ping_file_complete(
+            run_root / "PING-{:02d}-{:02d}".format(i, j))
+    ]
+    for i in node_ids:
+        pcap = run_root / "fit{}.pcap".format(i)
+        if not pcap.is_file() or pcap.stat().st_size == 0:
+            missing.append(pcap.name)
+    # RSSI.txt is published while the captures are coming in
+    if not (run_root / "RSSI.txt").is_file() \
+       or not aggregation_complete(run_root):
+        missing.append("RSSI.txt")
+    return missing
+
+
+class AggregateJob(AbstractJob):
+    """
+    records the capture of one node into an Aggregator; the
+    coroutine is only created when the job actually runs, so that
+    nothing is left un-awaited if the scheduler stops before
+
+    a capture that can't be read - e.g. truncated, or in pcapng -
+    only leaves its receiver out of RSSI.txt, the run goes on
+    """
+
+    def __init__(self, aggregator, node_id, **kwds):
+        self.aggregator = aggregator
+        self.node_id = node_id
+        super().__init__(**kwds)
+
+    async def co_run(self):
+        try:
+            await self.aggregator.co_record(self.node_id, from_pcaps=True)
+        except (ValueError, OSError) as exc:
+            print("cannot aggregate RSSIs from fit{:02d} - ignored - {}"
+                  .format(self.node_id, exc))
+
+    async def co_shutdown(self):
+        pass
+
+
 def one_run(wireless_driver,
             tx_power, phy_rate, antenna_mask, channel, *,
             run_name=default_run_name, slicename=default_slicename,
             load_images=False, node_ids=None,
             parallel=None,
-            verbose_ssh=False, verbose_jobs=False, dry_run=False):
+            verbose_ssh=False, verbose_jobs=False, dry_run=False,
+            resume=False, pool=None):
     """
     Performs data acquisition on all nodes with the following settings
 
@@ -111,6 +180,12 @@ def one_run(wireless_driver,
         parallel: a number of simulataneous jobs to run
                   1 means all data acquisition is sequential (default)
                   0 means maximum parallel
+        resume: if set, do nothing if the results for these settings
+                are already complete; as RSSI.txt is computed from
+                the pcap files of all nodes, the data acquisition
+                is otherwise done again from scratch
+        pool: an SshPool to get the nodes from, so that their ssh
+              connections are kept open for the next runs
     """
 
     #
@@ -136,15 +211,35 @@ def one_run(wireless_driver,
     run_root = naming_scheme(run_name, tx_power, phy_rate,
                              antenna_mask, channel, autocreate=True)
 
+    if resume:
+        if load_checkpoint(run_name).get(run_root.name, {}).get('complete'):
+            print("{} is complete - skipped".format(run_root))
+            return True
+        missing = missing_results(run_root, node_ids)
+        if missing == ["RSSI.txt"]:
+            # the data is all there, only the aggregation is missing
+            print("{}: aggregating existing results".format(run_root))
+            Aggregator(run_root, node_ids, antenna_mask,
+                       wireless_driver).run(from_pcaps=True)
+            missing = missing_results(run_root, node_ids)
+        if not missing:
+            print("{} has all its results - skipped".format(run_root))
+            record_complete(run_root)
+            return True
+
     # the nodes involved
-    faraday = SshNode(hostname=default_gateway, username=slicename,
-                      formatter=TimeColonFormatter(), verbose=verbose_ssh)
+    if pool is not None:
+        faraday = pool.gateway
+    else:
+        faraday = SshNode(hostname=default_gateway, username=slicename,
+                          formatter=TimeColonFormatter(), verbose=verbose_ssh)
 
     # this is a python dictionary that allows to retrieve a node object
     # from an id
     node_index = {
-        id: SshNode(gateway=faraday, hostname=fitname(id), username="root",
-                    formatter=TimeColonFormatter(), verbose=verbose_ssh)
+        id: (pool.node(fitname(id)) if pool is not None else
+             SshNode(gateway=faraday, hostname=fitname(id), username="root",
+                     formatter=TimeColonFormatter(), verbose=verbose_ssh))
         for id in node_ids
     }
 
@@ -278,17 +373,30 @@ def one_run(wireless_driver,
             verbose=verbose_jobs,
             commands=[
                 Run("sleep 1;pkill tcpdump; sleep 1"),
-                RunScript("node-utilities.sh", "process-pcap", i),
+                # the pcap is parsed locally, see processmap
                 Run(
-                    "echo retrieving pcap trace and result-{i}.txt from fit{i:02d}".format(i=i)),
-                Pull(remotepaths=["/tmp/fit{}.pcap".format(i),
-                                  "/tmp/result-{}.txt".format(i)],
+                    "echo retrieving pcap trace from fit{i:02d}".format(i=i)),
+                Pull(remotepaths=["/tmp/fit{}.pcap".format(i)],
                      localpath=str(run_root)),
             ]
         )
         for i, nodei in node_index.items()
     ]
 
+    # aggregate each capture as soon as it is retrieved,
+    # so that RSSI.txt fills in while the other ones are coming
+    aggregator = Aggregator(run_root, node_ids, antenna_mask, wireless_driver)
+    aggregate_jobs = [
+        AggregateJob(
+            aggregator, i,
+            scheduler=scheduler,
+            required=retrieve,
+            critical=False,
+            label="aggregate RSSIs from fit{:02d}".format(i),
+        )
+        for i, retrieve in zip(node_index, retrieve_tcpdump)
+    ]
+
     # xxx this is a little fishy
     # should we not just consider that the default is parallel=1 ?
     if parallel is None:
@@ -310,16 +418,23 @@ def one_run(wireless_driver,
         jobs_window = parallel
 
     # if not in dry-run mode, let's proceed to the actual experiment
-    ok = scheduler.orchestrate(jobs_window=jobs_window)
+    timeline = Timeline(scheduler)
+    if pool is not None:
+        scheduler.jobs_window = jobs_window
+        ok = pool.run(scheduler)
+    else:
+        ok = scheduler.orchestrate(jobs_window=jobs_window)
     # give details if it failed
     if not ok:
         scheduler.debrief()
 
-    # data acquisition is done, let's aggregate results
-    # i.e. compute averages
-    if ok:
-        post_processor = Aggregator(run_root, node_ids, antenna_mask, wireless_driver)
-        post_processor.run()
+    # results have been aggregated along the way
+    if ok and not missing_results(run_root, node_ids):
+        record_complete(run_root)
+
+    timeline.save(run_root / TIMELINE)
+    timeline.save_chrome_trace(run_root / CHROME_TRACE)
+    timeline.print_summary()
 
     return ok
 
@@ -336,6 +451,10 @@ def all_runs(wireless_driver,
     Example:
         all_runs([5, 14], [1], [1], [1, 40], ...)
         will call one_run exactly 4 times
+
+    With resume=True, the runs recorded as complete are skipped
+
+    All the runs share the same ssh connections
     """
     # we don't use all() on a list comprehension because
     # (*) we want to run all configs regardless of a failure, and
@@ -346,17 +465,31 @@ def all_runs(wireless_driver,
     if wireless_driver == "iwlwifi":
         antenna_masks = [1]
 
+    run_name = kwds.get('run_name', default_run_name)
+    completed = completed_runs(run_name) if kwds.get('resume') else set()
+
     overall = True
-    for tx_power in tx_powers:
-        for phy_rate in phy_rates:
-            for antenna_mask in antenna_masks:
-                for channel in channels:
-                    # record any failure
-                    if not one_run(wireless_driver, tx_power, phy_rate, antenna_mask,
-                                   channel, *args, **kwds):
-                        overall = False
-                    # make sure images will get loaded only once
-                    kwds['load_images'] = False
+    with SshPool(default_gateway,
+                 kwds.get('slicename', default_slicename),
+                 verbose=kwds.get('verbose_ssh', False)) as pool:
+        for tx_power in tx_powers:
+            for phy_rate in phy_rates:
+                for antenna_mask in antenna_masks:
+                    for channel in channels:
+                        # checked here so that images get loaded
+                        # in the first actual run
+                        run_root = naming_scheme(run_name, tx_power, phy_rate,
+                                                 antenna_mask, channel)
+                        if run_root.name in completed:
+                            print("{} is complete - skipped".format(run_root))
+                            continue
+                        # record any failure
+                        if not one_run(wireless_driver, tx_power, phy_rate,
+                                       antenna_mask, channel, *args,
+                                       pool=pool, **kwds):
+                            overall = False
+                        # make sure images will get loaded only once
+                        kwds['load_images'] = False
     return overall
 
 
@@ -418,6 +551,9 @@ def main():
     # parser.add_argument("-N", "--ping-number", default=ping_number,
     #                    help="specify number of ping packets to send")
 
+    parser.add_argument("--resume", default=False, action='store_true',
+                        help="skip the settings whose results are"
+                        " already complete in the output directory")
     parser.add_argument("-n", "--dry-run", default=False, action='store_true',
                         help="do not run anything, just print out scheduler,"
                         " and generate .dot file")
@@ -438,6 +574,7 @@ def main():
                     verbose_jobs=args.debug,
                     parallel=args.parallel,
                     dry_run=args.dry_run,
+                    resume=args.resume,
                     wireless_driver=args.wifi_driver
                     # ping_timeout = args.ping_timeout
                     # ping_interval = args.ping_interval
@@ -0,0 +1,182 @@
+"""
+comparing radiomaps across configurations
+
+acquiremap stores one t{t}-r{r}-a{a}-ch{ch} directory per
+configuration; RadioMaps loads all the RSSI.txt files under a
+datadir into one array, with labelled axes, so that configurations
+can be compared for all links at once, e.g.
+
+    maps = RadioMaps("datasample2")
+    # how many dB one gains on each link with 3 antennas instead of 1
+    gain = maps.diversity_gain(7)
+    # the dB/dB slope of RSSI vs tx power, for each link
+    slope = maps.tx_power_sensitivity()
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+
+from rssi import load_rssi
+
+# see naming_scheme in acquiremap
+CONFIG_PATTERN = re.compile(r"t(?P<tx_power>\d+)-r(?P<phy_rate>\d+)"
+                            r"-a(?P<antenna_mask>\d+)-ch(?P<channel>\d+)$")
+
+CONFIG_AXES = ('tx_power', 'phy_rate', 'antenna_mask', 'channel')
+AXES = CONFIG_AXES + ('sender', 'receiver', 'rank')
+
+# the values that Aggregator writes when there is no measurement
+RSSI_MAX = 0
+RSSI_MIN = -100
+
+
+def scan_configs(datadir):
+    """
+    returns a dict (tx_power, phy_rate, antenna_mask, channel) -> path
+    for all the RSSI.txt files under datadir
+    """
+    configs = {}
+    for run_root in sorted(Path(datadir).iterdir()):
+        match = CONFIG_PATTERN.match(run_root.name)
+        if match and (run_root / "RSSI.txt").is_file():
+            config = tuple(int(match.group(axis)) for axis in CONFIG_AXES)
+            configs[config] = run_root / "RSSI.txt"
+    return configs
+
+
+class RadioMaps:
+    """
+    all the radiomaps in a datadir, stacked in a float32 array
+    self.data, whose axes are AXES, i.e.
+    (tx_power, phy_rate, antenna_mask, channel, sender, receiver, rank)
+
+    self.coords gives the values along each axis; senders and
+    receivers are node ids, that are also their index in the array;
+    rank 0 is the combined RSSI, then one rank per antenna
+
+    configurations that were not measured, and missing values,
+    are nan; so are by default the placeholders that Aggregator
+    writes for couples without any measurement, i.e. 0 for a node
+    to itself and -100 otherwise
+    """
+
+    def __init__(self, datadir, *, mask_defaults=True):
+        self.datadir = Path(datadir)
+        configs = scan_configs(datadir)
+        if not configs:
+            raise ValueError("no RSSI.txt found under {}".format(datadir))
+        cubes = {config: load_rssi(path) for config, path in configs.items()}
+        nodes = max(cube.shape[0] for cube in cubes.values())
+        ranks = max(cube.shape[2] for cube in cubes.values())
+        self.coords = {
+            axis: np.array(sorted({config[i] for config in configs}))
+            for i, axis in enumerate(CONFIG_AXES)
+        }
+        self.coords['sender'] = self.coords['receiver'] = np.arange(nodes)
+        self.coords['rank'] = np.arange(ranks)
+        shape = tuple(len(self.coords[axis]) for axis in AXES)
+        self.data = np.full(shape, np.nan, dtype=np.float32)
+        for config, cube in cubes.items():
+            index = tuple(self.position(axis, value)
+                          for axis, value in zip(CONFIG_AXES, config))
+            size, _, width = cube.shape
+            self.data[index][:size, :size, :width] = cube
+        if mask_defaults:
+            self.data[self.data == RSSI_MIN] = np.nan
+            diagonal = np.arange(nodes)
+            self.data[..., diagonal, diagonal, :] = np.nan
+
+    def __repr__(self):
+        axes = ", ".join("{}={}".format(axis, len(self.coords[axis]))
+                         for axis in AXES)
+        return "RadioMaps({}: {})".format(self.datadir, axes)
+
+    def position(self, axis, value):
+        """
+        the index of value along axis
+        """
+        positions = np.flatnonzero(self.coords[axis] == value)
+        if not len(positions):
+            raise KeyError("{}={} not in {}".format(axis, value, self.datadir))
+        return positions[0]
+
+    def sel(self, **selection):
+        """
+        the array restricted to the selected values, e.g.
+        sel(tx_power=14, rank=0); the selected axes are dropped,
+        the other ones remain in the AXES order
+        """
+        unknown = set(selection) - set(AXES)
+        if unknown:
+            raise KeyError("unknown axes {}".format(sorted(unknown)))
+        index = tuple(self.position(axis, selection[axis])
+                      if axis in selection else slice(None)
+                      for axis in AXES)
+        return self.data[index]
+
+    def axes(self, *selected):
+        """
+        the names of the axes left after selecting on selected
+        """
+        return tuple(axis for axis in AXES if axis not in selected)
+
+    def delta(self, axis, value, reference, **selection):
+        """
+        the difference between the maps at axis=value and the ones
+        at axis=reference, e.g. delta('channel', 11, 1) for all links
+        and all other configuration parameters; the result has
+        the axes self.axes(axis, *selection)
+        """
+        selection.pop(axis, None)
+        return (self.sel(**{axis: value}, **selection)
+                - self.sel(**{axis: reference}, **selection))
+
+    def tx_power_sensitivity(self, rank=0, **selection):
+        """
+        for each link, the slope in dB/dB of a least squares fit of
+        the RSSI vs the tx power, computed on the tx powers where
+        the link was measured - nan if it was on less than 2 of them;
+        the result has the axes self.axes('tx_power', 'rank', *selection)
+        """
+        selection['rank'] = rank
+        selection.pop('tx_power', None)
+        values = self.sel(**selection).astype(float)
+        # move tx_power last, and broadcast its values
+        values = np.moveaxis(values, 0, -1)
+        powers = np.broadcast_to(self.coords['tx_power'].astype(float),
+                                 values.shape)
+        measured = ~np.isnan(values)
+        counts = measured.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_power = np.where(measured, powers, 0).sum(axis=-1) / counts
+            mean_value = np.where(measured, values, 0).sum(axis=-1) / counts
+            dx = np.where(measured, powers - mean_power[..., np.newaxis], 0)
+            dy = np.where(measured, values - mean_value[..., np.newaxis], 0)
+            slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+        return np.where(counts >= 2, slope, np.nan)
+
+    def diversity_gain(self, antenna_mask, reference=1, **selection):
+        """
+        for each link, how many dB the combined RSSI gains when
+        using antenna_mask rather than the reference mask, 1 antenna;
+        the result has the axes self.axes('antenna_mask', 'rank', *selection)
+        """
+        selection['rank'] = 0
+        return self.delta('antenna_mask', antenna_mask, reference,
+                          **selection)
+
+    def combining_gain(self, **selection):
+        """
+        for each link and configuration, how many dB the combined
+        RSSI gains over the best single antenna;
+        the result has the axes self.axes('rank', *selection)
+        """
+        selection.pop('rank', None)
+        values = self.sel(**selection)
+        antennas = values[..., 1:]
+        best = np.full(antennas.shape[:-1], np.nan, dtype=values.dtype)
+        measured = ~np.isnan(antennas).all(axis=-1)
+        best[measured] = np.nanmax(antennas[measured], axis=-1)
+        return values[..., 0] - best
@@ -0,0 +1,299 @@
+"""
+predicting link quality for configurations that were not measured
+
+PathLossModel fits a log-distance path loss model on the radiomaps
+of a datadir, i.e. for each link (sender, receiver)
+
+    RSSI = intercept + tx_gain * tx_power
+           - 10 * exponent * log10(distance) + channel_offset[channel]
+           + residual[sender, receiver]
+
+where distance is measured on the R2lab grid, and residual is
+the mean error of the link over all measured configurations,
+which accounts for walls, antennas orientation and the like
+
+DeliveryModel then fits the packet delivery ratio as a logistic
+function of the predicted RSSI, on the pings of batman-vs-olsr runs,
+so that one can e.g.
+
+    from compare import RadioMaps
+    links = PathLossModel(RadioMaps("datasample2"))
+    delivery = DeliveryModel.from_pings(links, "../batman-vs-olsr/datasample")
+    delivery.predict(links.predict(tx_power=1, channel=10))
+"""
+
+import re
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from channels import channel_frequency
+from rssi import GEOMETRY
+
+
+def grid_distances(size):
+    """
+    a (size, size) array of the distances between nodes
+    on the R2lab grid, indexed by node ids; nan where undefined,
+    i.e. for a node to itself, or for an unknown node id
+    """
+    xs = np.full(size, np.nan)
+    ys = np.full(size, np.nan)
+    known = GEOMETRY.node_ids[GEOMETRY.node_ids < size]
+    xs[known], ys[known] = GEOMETRY.xs[known], GEOMETRY.ys[known]
+    distances = np.hypot(xs[:, np.newaxis] - xs[np.newaxis, :],
+                         ys[:, np.newaxis] - ys[np.newaxis, :])
+    distances[distances == 0] = np.nan
+    return distances
+
+
+class PathLossModel:
+    """
+    a log-distance path loss model, with one offset per channel
+    and one residual per link, fitted on a RadioMaps instance
+
+    the fit uses one (phy_rate, antenna_mask) combination, that
+    defaults to the lowest rate and the most antennas, and one
+    RSSI rank, that defaults to the combined RSSI
+
+    after the fit, the model parameters are available as attributes
+    intercept, tx_gain, exponent and channel_offsets - a dict
+    channel -> offset, 0 for the first channel; residuals is a
+    (size, size) array, nan for links that were never measured;
+    rmse and link_rmse are the root mean square errors of the fit,
+    without and with the residuals
+    """
+
+    def __init__(self, maps, *, phy_rate=None, antenna_mask=None, rank=0):
+        self.phy_rate = (phy_rate if phy_rate is not None
+                         else maps.coords['phy_rate'].min())
+        self.antenna_mask = (antenna_mask if antenna_mask is not None
+                             else maps.coords['antenna_mask'].max())
+        self.rank = rank
+        # axes are tx_power, channel, sender, receiver
+        values = maps.sel(phy_rate=self.phy_rate,
+                          antenna_mask=self.antenna_mask,
+                          rank=rank).astype(float)
+        self.size = values.shape[-1]
+        self.distances = grid_distances(self.size)
+        self.channels = maps.coords['channel']
+        self._fit(values, maps.coords['tx_power'])
+
+    def _fit(self, values, tx_powers):
+        measured = ~np.isnan(values) & ~np.isnan(self.distances)
+        t, c, senders, receivers = np.nonzero(measured)
+        observed = values[measured]
+        # one column per parameter: intercept, tx_gain, exponent
+        # and the offsets of all channels but the first one
+        columns = [np.ones(len(observed)),
+                   tx_powers[t].astype(float),
+                   -10 * np.log10(self.distances[senders, receivers])]
+        columns += [(c == index).astype(float)
+                    for index in range(1, len(self.channels))]
+        design = np.stack(columns, axis=1)
+        # with a single tx power, the intercept and tx_gain can't be told
+        # apart; lstsq then returns the minimum norm solution
+        parameters, *_ = np.linalg.lstsq(design, observed, rcond=None)
+        self.intercept, self.tx_gain, self.exponent = parameters[:3]
+        self.channel_offsets = dict(zip(
+            self.channels.tolist(), [0.] + parameters[3:].tolist()))
+
+        errors = observed - design @ parameters
+        sums = np.zeros((self.size, self.size))
+        counts = np.zeros((self.size, self.size))
+        np.add.at(sums, (senders, receivers), errors)
+        np.add.at(counts, (senders, receivers), 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.residuals = sums / counts
+        self.rmse = np.sqrt(np.mean(errors ** 2))
+        self.link_rmse = np.sqrt(np.mean(
+            (errors - self.residuals[senders, receivers]) ** 2))
+
+    def __repr__(self):
+        return ("PathLossModel(RSSI = {:.1f} + {:.2f} * tx_power"
+                " - 10 * {:.2f} * log10(d) + channel offset,"
+                " rmse={:.2f}dB, with residuals {:.2f}dB)"
+                .format(self.intercept, self.tx_gain, self.exponent,
+                        self.rmse, self.link_rmse))
+
+    def channel_offset(self, channel):
+        """
+        the offset for channel; for a channel that was not measured,
+        the one of the closest measured channel, corrected with the
+        free space loss difference, i.e. 20 * log10 of the frequency ratio
+        """
+        channel = int(channel)
+        if channel in self.channel_offsets:
+            return self.channel_offsets[channel]
+        frequency = channel_frequency[channel]
+        closest = min(self.channel_offsets,
+                      key=lambda measured: abs(
+                          channel_frequency[measured] - frequency))
+        return (self.channel_offsets[closest]
+                - 20 * np.log10(frequency / channel_frequency[closest]))
+
+    def predict(self, tx_power, channel, residuals=True):
+        """
+        a (size, size) array of the predicted RSSIs, indexed by
+        (sender, receiver); with residuals, the per-link residual
+        is added for the links that were measured
+        """
+        rssi = (self.intercept + self.tx_gain * tx_power
+                - 10 * self.exponent * np.log10(self.distances)
+                + self.channel_offset(channel))
+        if residuals:
+            rssi = rssi + np.nan_to_num(self.residuals)
+        return rssi
+
+
+####################
+# the pings of batman-vs-olsr runs, as stored in their PINGS.npz
+# see ingest_pings() in batman-vs-olsr/datastore.py
+PINGS_STORE = "PINGS.npz"
+# see naming_scheme() in batman-vs-olsr/datastore.py
+RUN_PATTERN = re.compile(r"t(?P<tx_power>\d+)-r(?P<phy_rate>\d+)"
+                         r"-a(?P<antenna_mask>\d+)-ch(?P<channel>\d+)"
+                         r"-I(?P<interference>[-\w]+?)-(?P<protocol>\w+)$")
+
+PingSamples = namedtuple(
+    'PingSamples',
+    ['source', 'destination', 'tx_power', 'channel', 'sent', 'received'])
+
+
+def ping_samples(run_name, *, interference="None", protocol=None):
+    """
+    the number of pings sent and received for each (source, destination)
+    in the runs of run_name with that interference, and that protocol
+    if specified; returns a PingSamples of arrays
+
+    run_name/PINGS.npz is created by batman-vs-olsr when its results
+    are first loaded, see load_pings() over there
+    """
+    store = Path(run_name) / PINGS_STORE
+    with np.load(str(store)) as arrays:
+        configs = arrays['configs']
+        pair_config = arrays['pair_config']
+        samples = PingSamples(
+            arrays['pair_source'].astype(int),
+            arrays['pair_destination'].astype(int),
+            np.zeros(len(pair_config), dtype=int),
+            np.zeros(len(pair_config), dtype=int),
+            arrays['pair_nb_packets'].astype(int),
+            np.diff(arrays['pair_offset']).astype(int))
+    selected = np.zeros(len(pair_config), dtype=bool)
+    for index, config in enumerate(configs):
+        match = RUN_PATTERN.match(str(config))
+        if not match or match.group('interference') != str(interference):
+            continue
+        if protocol is not None and match.group('protocol') != protocol:
+            continue
+        pairs = pair_config == index
+        samples.tx_power[pairs] = int(match.group('tx_power'))
+        samples.channel[pairs] = int(match.group('channel'))
+        selected |= pairs
+    # pings whose header was missing have no packets sent
+    selected &= samples.sent > 0
+    return PingSamples(*(array[selected] for array in samples))
+
+
+def _logistic(x):
+    # same as 1 / (1 + exp(-x)), without overflows
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+class DeliveryModel:
+    """
+    the packet delivery ratio - received / sent, i.e. 1 minus what
+    batman-vs-olsr calls PDR - as a logistic function of the RSSI
+
+        delivery = 1 / (1 + exp(-(alpha + beta * rssi)))
+
+    fitted by maximum likelihood on binomial counts
+    """
+
+    def __init__(self, alpha=0., beta=0.):
+        self.alpha, self.beta = alpha, beta
+
+    def __repr__(self):
+        midpoint = -self.alpha / self.beta if self.beta else np.nan
+        return ("DeliveryModel(alpha={:.3f}, beta={:.3f}, 50% at {:.1f}dBm)"
+                .format(self.alpha, self.beta, midpoint))
+
+    def fit(self, rssi, sent, received, *,
+            penalty=1e-3, iterations=50, tolerance=1e-8):
+        """
+        Newton's method on the log-likelihood; rssi, sent and received
+        are arrays with one entry per sample; returns self
+
+        the small L2 penalty on the parameters keeps them finite when
+        the samples are separable, e.g. all links above some RSSI
+        deliver all packets and all those below deliver none
+        """
+        rssi, sent, received = (np.asarray(array, dtype=float)
+                                for array in (rssi, sent, received))
+        keep = ~np.isnan(rssi) & (sent > 0)
+        rssi, sent, received = rssi[keep], sent[keep], received[keep]
+        design = np.stack([np.ones(len(rssi)), rssi], axis=1)
+        parameters = np.array([self.alpha, self.beta])
+        for _ in range(iterations):
+            probabilities = _logistic(design @ parameters)
+            gradient = (design.T @ (received - sent * probabilities)
+                        - penalty * parameters)
+            weights = sent * probabilities * (1 - probabilities)
+            hessian = (design.T @ (design * weights[:, np.newaxis])
+                       + penalty * np.eye(2))
+            step = np.linalg.solve(hessian, gradient)
+            parameters = parameters + step
+            if np.abs(step).max() < tolerance:
+                break
+        self.alpha, self.beta = parameters
+        return self
+
+    def predict(self, rssi):
+        """
+        the delivery ratio for rssi, a scalar or an array
+        """
+        return _logistic(self.alpha + self.beta * np.asarray(rssi))
+
+    @staticmethod
+    def from_pings(path_loss, run_name, **selection):
+        """
+        fits a DeliveryModel on the pings in run_name, see ping_samples,
+        against the RSSIs that path_loss predicts for them
+
+        these are end-to-end pings, that may be relayed by the routing
+        protocol, so this models what can be expected from a pair of
+        nodes in a mesh, more than from a single hop
+        """
+        samples = ping_samples(run_name, **selection)
+        rssi = np.full(len(samples.source), np.nan)
+        inside = ((samples.source < path_loss.size)
+                  & (samples.destination < path_loss.size))
+        for tx_power, channel in set(zip(samples.tx_power.tolist(),
+                                         samples.channel.tolist())):
+            config = (inside & (samples.tx_power == tx_power)
+                      & (samples.channel == channel))
+            predicted = path_loss.predict(tx_power, channel)
+            rssi[config] = predicted[samples.source[config],
+                                     samples.destination[config]]
+        return DeliveryModel().fit(rssi, samples.sent, samples.received)
+
+
+def score_configs(path_loss, delivery, configs, node_ids, *, threshold=0.9):
+    """
+    to prune (tx_power, channel) configs before trying them on the
+    testbed: for each config, the fraction of pairs among node_ids
+    whose predicted delivery ratio is at least threshold
+
+    returns a list of (config, fraction), best first
+    """
+    node_ids = np.array(node_ids)
+    pairs = np.ix_(node_ids, node_ids)
+    others = ~np.eye(len(node_ids), dtype=bool)
+    scores = []
+    for tx_power, channel in configs:
+        ratios = delivery.predict(path_loss.predict(tx_power, channel)[pairs])
+        scores.append(((tx_power, channel),
+                       float(np.mean(ratios[others] >= threshold))))
+    return sorted(scores, key=lambda score: -score[1])
@@ -3,40 +3,189 @@ helper to read a RSSI.txt file
 maybe should belong in processmap.py
 """
 
+import os
+from functools import lru_cache
+from pathlib import Path
+
 import numpy as np
 
 from r2lab import R2labMap
 
+
+# a binary copy of RSSI.txt, written next to it on first load
+SIDECAR = "RSSI.npz"
+
+
+def parse_rssi(filename):
+    """
+    parses a RSSI.txt file into a float32 cube indexed by
+    (sender, receiver, rank) - node ids are used as indexes
+    as is, so index 0 is unused; missing values are nan
+    """
+    lines = []
+    with open(filename) as in_file:
+        for line in in_file:
+            ip_snd, ip_rcv, *values = line.split()
+            *_, n_snd = ip_snd.split('.')
+            *_, n_rcv = ip_rcv.split('.')
+            lines.append((int(n_snd), int(n_rcv), values))
+    if not lines:
+        return np.full((0, 0, 0), np.nan, dtype=np.float32)
+    size = max(max(snd, rcv) for snd, rcv, _ in lines) + 1
+    ranks = max(len(values) for *_, values in lines)
+    cube = np.full((size, size, ranks), np.nan, dtype=np.float32)
+    for snd, rcv, values in lines:
+        cube[snd, rcv, :len(values)] = [float(value) for value in values]
+    return cube
+
+
+def _load_sidecar(sidecar, stat):
+    """
+    the cube stored in sidecar, if it was made from
+    the RSSI.txt whose stat is given; None otherwise
+    """
+    try:
+        with np.load(str(sidecar)) as stored:
+            if tuple(stored['source']) == (stat.st_mtime_ns, stat.st_size):
+                return stored['cube']
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _save_sidecar(sidecar, stat, cube):
+    temporary = sidecar.with_name(sidecar.name + ".tmp")
+    try:
+        with temporary.open('wb') as output:
+            np.savez(output, cube=cube,
+                     source=np.array([stat.st_mtime_ns, stat.st_size]))
+        os.replace(str(temporary), str(sidecar))
+    except OSError:
+        # e.g. a read-only dataset, the sidecar is just an optimization
+        pass
+
+
+@lru_cache(maxsize=64)
+def _load_cube(filename, mtime_ns, size, sidecar):                 # pylint: disable=w0613
+    path = Path(filename)
+    stat = path.stat()
+    sidecar_path = path.with_name(SIDECAR)
+    cube = _load_sidecar(sidecar_path, stat) if sidecar else None
+    if cube is None:
+        cube = parse_rssi(path)
+        if sidecar:
+            _save_sidecar(sidecar_path, stat, cube)
+    # the cached cube is shared among callers
+    cube.setflags(write=False)
+    return cube
+
+
+def load_rssi(filename, sidecar=True):
+    """
+    returns the RSSI.txt file as a read-only float32 cube, see parse_rssi
+
+    cubes are cached in memory, keyed on the file's path and
+    modification time, so a file that gets rewritten - e.g. while
+    a run is in progress - is loaded again; with sidecar, a binary
+    copy RSSI.npz is also stored next to the file, and used
+    on later loads from other processes
+    """
+    stat = os.stat(str(filename))
+    return _load_cube(str(Path(filename).resolve()),
+                      stat.st_mtime_ns, stat.st_size, sidecar)
+
+
+def rssi_vector(filename, sender, rssi_rank):
+    """
+    the values received from sender at rssi_rank, as a vector
+    indexed by receiver node id, nan for missing values;
+    raises IndexError if sender or rssi_rank are out of the file range
+    """
+    return load_rssi(filename)[sender, :, rssi_rank]
+
+
 def read_rssi(filename, sender, rssi_rank):
     '''
     read a RSSI file and, given a sender node and
     an rssi_rank, returns a dictionary
-    receiver_node_number -> value
+    receiver_node_number -> value (a float)
     '''
-
-    node_number_to_value = {}
     try:
-        with open(filename) as in_file:
-            for line in in_file:
-                try:
-                    ip_snd, ip_rcv, *values = line.split()
-                    *_, n_snd = ip_snd.split('.')
-                    *_, n_rcv = ip_rcv.split('.')
-                    n_snd = int(n_snd)
-                    n_rcv = int(n_rcv)
-                    if n_snd != sender:
-                        continue
-                    node_number_to_value[n_rcv] = values[rssi_rank]
-                except IndexError as e:
-                    print("rssi_rank {} not present in values"
-                          .format(rssi_rank))
+        cube = load_rssi(filename)
     except IOError as e:
         print("Cannot open file {}: {}" .format(filename, e))
+        return {}
+    if rssi_rank >= cube.shape[2]:
+        print("rssi_rank {} not present in values"
+              .format(rssi_rank))
+        return {}
+    if sender >= cube.shape[0]:
+        return {}
+    vector = cube[sender, :, rssi_rank]
+    receivers = np.flatnonzero(~np.isnan(vector))
+    # RSSI.txt has 2 decimals, get rid of the float32 noise
+    values = np.round(vector[receivers].astype(float), 2)
+    return dict(zip(receivers.tolist(), values.tolist()))
 
-    return node_number_to_value
 
 # convert to plotting
 
+class Geometry:
+    """
+    The layout of the R2lab nodes on the 5 x 9 grid, computed once
+    so that converting an RSSI vector for plotting boils down
+    to fancy indexing
+
+    Attributes:
+        xs, ys: arrays indexed by node id, with the (x, y) position
+                of each node; 0 at index 0 that is no node
+        node_ids: the array of all node ids
+        X, Y: the meshgrid of the positions, with shape (5, 9)
+        holes: a boolean mask of the grid cells that have no node
+        labels: the names of the nodes on the grid, "None" in the holes
+    """
+
+    # the value displayed in the holes of the grid
+    HOLE = -100
+
+    def __init__(self):
+        r2labmap = R2labMap()
+        positions = dict(r2labmap.iterate_nodes())
+        self.node_ids = np.array(sorted(positions))
+        self.xs = np.zeros(self.node_ids.max() + 1, dtype=int)
+        self.ys = np.zeros(self.node_ids.max() + 1, dtype=int)
+        for node_id, (x, y) in positions.items():
+            self.xs[node_id], self.ys[node_id] = x, y
+        width, height = self.xs.max(), self.ys.max()
+        self.X, self.Y = np.meshgrid(np.arange(1, width + 1, dtype=int),
+                                     np.arange(1, height + 1, dtype=int))
+        self.holes = np.ones((height, width), dtype=bool)
+        self.holes[self.ys[self.node_ids] - 1,
+                   self.xs[self.node_ids] - 1] = False
+        self.labels = np.full((height, width), "None", dtype=object)
+        self.labels[self.ys[self.node_ids] - 1, self.xs[self.node_ids] - 1] = \
+            ["fit{:02d}".format(node_id) for node_id in self.node_ids]
+
+    def as_vector(self, rssi):
+        """
+        rssi may be either a dict node_id -> value, or already a vector
+        indexed by node_id, where nan means no value for that node
+
+        Returns a tuple node_ids, values for the nodes that have a value
+        """
+        if isinstance(rssi, dict):
+            node_ids = np.fromiter(rssi.keys(), dtype=int, count=len(rssi))
+            values = np.array(list(rssi.values()), dtype=float)
+            return node_ids, values
+        rssi = np.asarray(rssi, dtype=float)
+        node_ids = np.flatnonzero(~np.isnan(rssi))
+        return node_ids, rssi[node_ids]
+
+
+# one global static object is good enough
+GEOMETRY = Geometry()
+
+
 #################### for plotly
 def rssi_to_heatmap(rssi_dict):
     """
@@ -44,21 +193,18 @@ def rssi_to_heatmap(rssi_dict):
     for plotting in plotly
 
     Parameters:
-        rssi_dict is expected to be a dict: node_id -> value
+        rssi_dict is expected to be a dict: node_id -> value,
+        or a vector indexed by node_id, see Geometry.as_vector
 
     Returns:
         a tuple X, Y, Z, T(ext) of arrays for plotly
     """
-    # input dict may have holes
-    r2labmap = R2labMap()
-    X, Y, Z, T = [], [], [], []
-    for node_id, value in rssi_dict.items():
-        x, y = r2labmap.position(node_id)
-        X.append(x)
-        Y.append(y)
-        Z.append(value)
-        T.append("fit{:02d}".format(node_id))
-    return X, Y, Z, T
+    # input may have holes
+    node_ids, values = GEOMETRY.as_vector(rssi_dict)
+    X = GEOMETRY.xs[node_ids]
+    Y = GEOMETRY.ys[node_ids]
+    T = GEOMETRY.labels[Y - 1, X - 1]
+    return X, Y, values, T
 
 
 def rssi_to_3d(rssi_dict):
@@ -68,23 +214,17 @@ def rssi_to_3d(rssi_dict):
     or ipyvolume (does not)
 
     Parameters:
-        rssi_dict is expected to be a dict: node_id -> value
+        rssi_dict is expected to be a dict: node_id -> value,
+        or a vector indexed by node_id, see Geometry.as_vector
 
     Returns:
         will return a triple X, Y, Z of numpy arrays for ipyvolume
     """
-    r2labmap = R2labMap()
-    # Make X,Y R2lab grid of nodes
-    X = np.arange(1, 10, 1, dtype=np.integer)
-    Y = np.arange(1, 6, 1, dtype=np.integer)
-    X, Y = np.meshgrid(X, Y)
-
-    Z = np.zeros((5, 9), dtype=np.float)
-    Z[0, 3] = Z[0, 4] = Z[0, 5] = -100 # np.nan
-    Z[3, 3] = Z[3, 5] = Z[2, 8] = Z[3, 8] = Z[4, 8] = -100 # np.nan
-    T = [ ["None"]*9 for i in range(6) ]
-    for node_id, value in rssi_dict.items():
-        x, y = r2labmap.position(node_id)
-        Z[y-1, x-1] = value
-        T[y-1][x-1]="fit{:02d}".format(node_id)
-    return X, Y, Z, T
+    node_ids, values = GEOMETRY.as_vector(rssi_dict)
+    rows, cols = GEOMETRY.ys[node_ids] - 1, GEOMETRY.xs[node_ids] - 1
+    Z = np.zeros(GEOMETRY.holes.shape, dtype=float)
+    Z[GEOMETRY.holes] = GEOMETRY.HOLE # np.nan
+    Z[rows, cols] = values
+    T = np.full(GEOMETRY.holes.shape, "None", dtype=object)
+    T[rows, cols] = GEOMETRY.labels[rows, cols]
+    return GEOMETRY.X, GEOMETRY.Y, Z, T.tolist()
@@ -0,0 +1,120 @@
+# pylint: disable=c0111
+"""
+    A pool of ssh connections that outlive a single scheduler
+
+    Without a pool, each run creates its own SshNode instances - the
+    gateway and one per fit node - and closes them when it is done;
+    so a campaign connects again through the gateway for each config
+
+    An SshPool hands out one SshNode per hostname, that all the
+    runs share; connections are thus established once, checked before
+    each run, and closed when the pool is closed
+
+    asyncssh connections are bound to the event loop they were created
+    in, so the pool owns one event loop, and all the schedulers that
+    use its nodes must be run through SshPool.run()
+"""
+
+import asyncio
+
+from apssh import SshNode
+from apssh import TimeColonFormatter
+
+
+class SshPool:
+
+    def __init__(self, gateway, username, *, verbose=False, timeout=10):
+        """
+        gateway and username are used to reach the gateway; the
+        other nodes are reached through it; timeout is for health checks
+        """
+        self.verbose = verbose
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.gateway = SshNode(
+            hostname=gateway, username=username,
+            formatter=TimeColonFormatter(), verbose=verbose)
+        # (hostname, username) -> SshNode
+        self.nodes = {}
+
+    def node(self, hostname, username="root"):
+        """
+        The SshNode for hostname, reached through the gateway;
+        the same instance is returned on each call
+        """
+        key = hostname, username
+        if key not in self.nodes:
+            self.nodes[key] = SshNode(
+                gateway=self.gateway, hostname=hostname, username=username,
+                formatter=TimeColonFormatter(), verbose=self.verbose)
+        return self.nodes[key]
+
+    async def _healthy(self, node):
+        try:
+            await asyncio.wait_for(node.conn.run("true", check=False),
+                                   timeout=self.timeout)
+            return True
+        except Exception:                               # pylint: disable=w0703
+            return False
+
+    async def _drop(self, node):
+        try:
+            await node.close()
+        except Exception:                               # pylint: disable=w0703
+            # the connection is broken anyway
+            node.conn = None
+            node.sftp_client = None
+
+    async def co_check(self):
+        """
+        Checks the connections that are open, and drops the ones
+        that don't respond, so that they get re-established when needed;
+        if the gateway is dropped, so are all the other ones
+
+        Returns the number of connections dropped
+        """
+        dropped = 0
+        if self.gateway.conn is not None \
+           and not await self._healthy(self.gateway):
+            print(f"ssh pool: lost connection to {self.gateway.hostname}")
+            for node in [*self.nodes.values(), self.gateway]:
+                if node.conn is not None:
+                    await self._drop(node)
+                    dropped += 1
+            return dropped
+        connected = [node for node in self.nodes.values()
+                     if node.conn is not None]
+        health = await asyncio.gather(
+            *(self._healthy(node) for node in connected))
+        for node, healthy in zip(connected, health):
+            if not healthy:
+                print(f"ssh pool: lost connection to {node.hostname}")
+                await self._drop(node)
+                dropped += 1
+        return dropped
+
+    def run(self, scheduler):
+        """
+        Checks the connections, and then runs scheduler in the pool
+        event loop; returns the same as scheduler.run()
+        """
+        self.loop.run_until_complete(self.co_check())
+        return self.loop.run_until_complete(scheduler.co_run())
+
+    async def co_close(self):
+        # the nodes first, then the gateway they go through
+        await asyncio.gather(*(self._drop(node)
+                               for node in self.nodes.values()))
+        await self._drop(self.gateway)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.run_until_complete(self.co_close())
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()